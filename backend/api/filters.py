@@ -1,17 +1,35 @@
 from django.contrib.auth import get_user_model
+from django.db.models.functions import Substr
 from django_filters.rest_framework import FilterSet, filters
 
+from recipes import search
 from recipes.models import Ingredient, Recipe, Tag
 
+from . import ingredient_index
+
 User = get_user_model()
 
 
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='startswith')
+    """Префиксы так же, как в api.ingredient_index"""
+
+    name = filters.CharFilter(method='filter_name')
+    name__istartswith = filters.CharFilter(method='filter_name_folded')
 
     class Meta:
         model = Ingredient
-        fields = ['name']
+        fields = ['name', 'name__istartswith']
+
+    def filter_name(self, queryset, name, value):
+        # сравнение строк, а не LIKE: регистр учитывается на любой базе
+        return queryset.alias(
+            name_prefix=Substr('name', 1, len(value))
+        ).filter(name_prefix=value)
+
+    def filter_name_folded(self, queryset, name, value):
+        return queryset.alias(
+            folded_name=ingredient_index.Casefold('name')
+        ).filter(folded_name__startswith=ingredient_index.fold(value))
 
 
 class RecipeFilter(FilterSet):
@@ -26,6 +44,11 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'popular'), ('trending', 'trending')),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
@@ -45,3 +68,12 @@ class RecipeFilter(FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        # по релевантности, если не задан ?ordering=
+        return search.search(queryset, value).order_by(
+            '-search_rank', '-pub_date', '-id')
+
+    def filter_ordering(self, queryset, name, value):
+        # RecipeQuerySet.popular() / trending()
+        return getattr(queryset, value)()
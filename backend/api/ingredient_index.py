@@ -0,0 +1,121 @@
+"""Процессный индекс ингредиентов для автодополнения по префиксу.
+
+Снимок таблицы ингредиентов хранится в двух отсортированных массивах
+(исходные и приведённые к нижнему регистру названия), поиск префикса —
+двоичный. Порядок выдачи совпадает с ORDER BY name базы: у каждой
+записи хранится её позиция в выборке ORM.
+
+Пока индекс не собран или устарел (сменилась версия 'ingredients'),
+lookup() возвращает None и запрос обслуживает ORM, а индекс
+пересобирается в фоновом потоке.
+
+Поиск одинаков в индексе и в базе (api.filters.IngredientFilter):
+?name= — префикс с учётом регистра, ?name__istartswith= — без учёта
+регистра по str.casefold(), в том числе для кириллицы. Обычные
+startswith/istartswith ORM для этого не подходят: LIKE в SQLite не
+различает регистр латиницы и различает регистр кириллицы. В SQLite
+casefold() — функция CASEFOLD, которую регистрирует add_casefold; в
+PostgreSQL — LOWER(), она расходится с casefold() только на редких
+буквах вроде ß.
+"""
+from bisect import bisect_left
+
+from django.db.backends.signals import connection_created
+from django.db.models import Func
+from django.dispatch import receiver
+
+from core.versions import IndexHolder
+from recipes.models import Ingredient
+
+VERSION = 'ingredients'
+PARAMS = {'name', 'name__istartswith', 'limit'}
+
+
+def fold(value):
+    """Регистронезависимый ключ, в том числе для кириллицы"""
+    return value.casefold()
+
+
+class Casefold(Func):
+    """fold() в SQL"""
+
+    function = 'LOWER'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function='CASEFOLD', **extra_context)
+
+
+@receiver(connection_created)
+def add_casefold(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            'CASEFOLD', 1, fold, deterministic=True)
+
+
+class IngredientIndex:
+    def __init__(self, rows, version):
+        self.version = version
+        self.items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for pk, name, measurement_unit in rows
+        ]
+        self.names, self.name_ranks = self.sorted_keys(lambda name: name)
+        self.folded, self.folded_ranks = self.sorted_keys(fold)
+
+    def sorted_keys(self, key):
+        pairs = sorted(
+            (key(item['name']), rank) for rank, item in enumerate(self.items)
+        )
+        return [key for key, _ in pairs], [rank for _, rank in pairs]
+
+    @staticmethod
+    def prefix_ranks(keys, ranks, prefix):
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', start)
+        return ranks[start:end]
+
+    def search(self, prefix=None, iprefix=None, limit=None):
+        """Аналог name__startswith / name__istartswith в порядке ORM"""
+        ranks = None
+        if prefix:
+            ranks = set(
+                self.prefix_ranks(self.names, self.name_ranks, prefix))
+        if iprefix:
+            found = self.prefix_ranks(
+                self.folded, self.folded_ranks, fold(iprefix))
+            ranks = set(found) if ranks is None else ranks.intersection(
+                found)
+        if ranks is None:
+            return self.items[:limit]
+        return [self.items[rank] for rank in sorted(ranks)[:limit]]
+
+
+def build(version):
+    rows = Ingredient.objects.values_list('id', 'name', 'measurement_unit')
+    return IngredientIndex(list(rows), version)
+
+
+holder = IndexHolder(VERSION, build)
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+def lookup(query_params):
+    """Результат из индекса или None, если запрос должен идти в ORM"""
+    if not set(query_params) <= PARAMS:
+        return None
+    index = holder.get()
+    if index is None:
+        return None
+    return index.search(
+        prefix=query_params.get('name'),
+        iprefix=query_params.get('name__istartswith'),
+        limit=parse_limit(query_params.get('limit')),
+    )
@@ -0,0 +1,245 @@
+import base64
+import json
+import statistics
+import time
+import tracemalloc
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+
+def image_base64():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (226, 108, 45)).save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the API routes through the Django test client against the '
+        'current database (see generate_data) and record p50/p95 latency, '
+        'queries per request and peak memory. Write routes run as '
+        'add/remove pairs, so the data is left as it was. Logout, '
+        'set_password and user registration are not benchmarked.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--email', help='User to run as (default: the first user)')
+        parser.add_argument('--requests', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--output', help='Save the results as JSON')
+        parser.add_argument(
+            '--compare', help='Baseline JSON to print the difference with')
+        parser.add_argument(
+            '--strict-queries', action='store_true',
+            help='Fail if a route runs more queries than in --compare')
+
+    def handle(self, *args, **options):
+        user = (
+            User.objects.filter(email=options['email']).first()
+            if options['email'] else User.objects.order_by('id').first()
+        )
+        if user is None:
+            raise CommandError('No user to run as, run generate_data first')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        scenarios = self.scenarios(user)
+
+        timings = {name: [] for name, *_ in scenarios}
+        queries = {name: [] for name, *_ in scenarios}
+        for iteration in range(options['warmup'] + options['requests']):
+            state = {}
+            for name, method, path, data in scenarios:
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    self.request(name, method, path, data, state)
+                    elapsed = time.perf_counter() - started
+                if iteration >= options['warmup']:
+                    timings[name].append(elapsed * 1000)
+                    queries[name].append(len(captured.captured_queries))
+
+        memory = {}
+        state = {}
+        tracemalloc.start()
+        for name, method, path, data in scenarios:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            self.request(name, method, path, data, state)
+            peak = tracemalloc.get_traced_memory()[1]
+            memory[name] = (peak - before) / 1024
+        tracemalloc.stop()
+
+        results = {
+            'meta': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'requests': options['requests'],
+            },
+            'routes': {
+                name: {
+                    'p50_ms': round(statistics.median(timings[name]), 3),
+                    'p95_ms': round(self.p95(timings[name]), 3),
+                    'queries': max(queries[name]),
+                    'peak_kib': round(memory[name], 1),
+                }
+                for name, *_ in scenarios
+            },
+        }
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)['routes']
+        self.print_results(results['routes'], baseline)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+        if options['strict_queries'] and baseline:
+            grown = [
+                name for name, result in results['routes'].items()
+                if name in baseline
+                and result['queries'] > baseline[name]['queries']
+            ]
+            if grown:
+                raise CommandError(
+                    f'More queries than the baseline: {", ".join(grown)}')
+
+    @staticmethod
+    def p95(values):
+        if len(values) < 2:
+            return values[0]
+        return statistics.quantiles(values, n=20, method='inclusive')[18]
+
+    def scenarios(self, user):
+        """(имя, метод, путь, тело); {recipe} в пути берётся из state"""
+        recipe = Recipe.objects.order_by('-pub_date').first()
+        # один рецепт для одиночных запросов и пакет из десяти
+        free = list(
+            Recipe.objects.exclude(favorites__user=user)
+            .exclude(shopping_cart__user=user).exclude(author=user)
+            .values_list('id', flat=True)[:11]
+        )
+        author = User.objects.exclude(id=user.id).exclude(
+            subscription__user=user).first()
+        tag = Tag.objects.first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        if None in (recipe, author, tag, ingredient) or len(free) < 2:
+            raise CommandError('Not enough data, run generate_data first')
+        free, batch = free[0], {'recipes': free[1:]}
+        recipe_data = {
+            'tags': [tag.id],
+            'ingredients': [{'id': ingredient.id, 'amount': 10}],
+            'name': 'Рецепт для замера',
+            'text': 'Описание',
+            'image': image_base64(),
+            'cooking_time': 10,
+        }
+        pantry = ','.join(
+            str(pk) for pk in recipe.ingredients.values_list('id', flat=True))
+        created = '/api/recipes/{recipe}/'
+
+        return [
+            ('recipes-list', 'get', '/api/recipes/', None),
+            ('recipes-list-cursor', 'get', '/api/recipes/?cursor=', None),
+            ('recipes-list-popular', 'get',
+             '/api/recipes/?ordering=popular', None),
+            ('recipes-list-trending', 'get',
+             '/api/recipes/?ordering=trending', None),
+            ('recipes-search', 'get', '/api/recipes/?search=рецепт', None),
+            ('recipes-list-filtered', 'get',
+             f'/api/recipes/?tags={tag.slug}&is_favorited=1', None),
+            ('recipes-match', 'get',
+             f'/api/recipes/match/?ingredients={pantry}', None),
+            ('recipes-detail', 'get', f'/api/recipes/{recipe.id}/', None),
+            ('recipes-create', 'post', '/api/recipes/', recipe_data),
+            ('recipes-update', 'patch', created, recipe_data),
+            ('recipes-delete', 'delete', created, None),
+            ('recipes-favorite', 'post',
+             f'/api/recipes/{free}/favorite/', None),
+            ('recipes-unfavorite', 'delete',
+             f'/api/recipes/{free}/favorite/', None),
+            ('recipes-cart-add', 'post',
+             f'/api/recipes/{free}/shopping_cart/', None),
+            ('recipes-cart-remove', 'delete',
+             f'/api/recipes/{free}/shopping_cart/', None),
+            ('recipes-favorite-batch', 'post',
+             '/api/recipes/favorite/', batch),
+            ('recipes-unfavorite-batch', 'delete',
+             '/api/recipes/favorite/', batch),
+            ('recipes-cart-add-batch', 'post',
+             '/api/recipes/shopping_cart/', batch),
+            ('recipes-cart-remove-batch', 'delete',
+             '/api/recipes/shopping_cart/', batch),
+            ('recipes-feed', 'get', '/api/recipes/feed/', None),
+            ('recipes-download-cart', 'get',
+             '/api/recipes/download_shopping_cart/', None),
+            ('tags-list', 'get', '/api/tags/', None),
+            ('tags-detail', 'get', f'/api/tags/{tag.id}/', None),
+            ('ingredients-list', 'get',
+             f'/api/ingredients/?name={ingredient.name[:2]}', None),
+            ('ingredients-detail', 'get',
+             f'/api/ingredients/{ingredient.id}/', None),
+            ('users-list', 'get', '/api/users/', None),
+            ('users-detail', 'get', f'/api/users/{author.id}/', None),
+            ('users-me', 'get', '/api/users/me/', None),
+            ('users-subscriptions', 'get', '/api/users/subscriptions/', None),
+            ('users-subscriptions-limit', 'get',
+             '/api/users/subscriptions/?recipes_limit=3', None),
+            ('users-subscribe', 'post',
+             f'/api/users/{author.id}/subscribe/', None),
+            ('users-unsubscribe', 'delete',
+             f'/api/users/{author.id}/subscribe/', None),
+            ('auth-token-login', 'post', '/api/auth/token/login/',
+             {'email': user.email, 'password': 'generated-password'}),
+        ]
+
+    def request(self, name, method, path, data, state):
+        path = path.format_map(state)
+        response = getattr(self.client, method)(
+            path, data=json.dumps(data) if data else None,
+            content_type='application/json',
+        )
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code >= 300:
+            raise CommandError(
+                f'{name}: {method.upper()} {path} '
+                f'returned {response.status_code}')
+        if name == 'recipes-create':
+            state['recipe'] = response.json()['id']
+
+    def print_results(self, routes, baseline):
+        self.stdout.write(
+            f'{"route":<28}{"p50 ms":>10}{"p95 ms":>10}'
+            f'{"queries":>9}{"peak KiB":>10}')
+        for name, result in routes.items():
+            line = (
+                f'{name:<28}{result["p50_ms"]:>10.2f}'
+                f'{result["p95_ms"]:>10.2f}{result["queries"]:>9}'
+                f'{result["peak_kib"]:>10.1f}'
+            )
+            old = (baseline or {}).get(name)
+            if old:
+                change = (result['p50_ms'] / old['p50_ms'] - 1) * 100
+                line += f'  p50 {change:+.0f}%'
+                if result['queries'] != old['queries']:
+                    line += f', queries {old["queries"]} -> ' \
+                        f'{result["queries"]}'
+                    style = (
+                        self.style.ERROR
+                        if result['queries'] > old['queries']
+                        else self.style.SUCCESS
+                    )
+                    line = style(line)
+            self.stdout.write(line)
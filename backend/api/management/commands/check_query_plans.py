@@ -0,0 +1,169 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+)
+from users.models import Subscription
+
+User = get_user_model()
+
+# Полный просмотр таблицы без индекса считается регрессией, кроме
+# небольших справочников и промежуточных результатов подзапросов
+# (ranked — нумерация из RecipeQuerySet.latest_per_author).
+# Псевдонимы (U0, T4) SQLite выводит без имени таблицы, они
+# проверяются наравне с остальными.
+ALLOWED_SCANS = {'recipes_tag', 'recipes_ingredient', 'subquery', 'ranked'}
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+# Обход всего индекса дешевле обхода таблицы, только пока порядок
+# индекса совпадает с ORDER BY и запрос останавливается на LIMIT.
+# Если после такого обхода SQLite всё равно сортирует во временном
+# B-дереве, читается весь индекс — это та же регрессия.
+INDEX_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)? USING ')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway SQLite database, request the main API '
+        'endpoints and fail if EXPLAIN QUERY PLAN shows a full scan '
+        'of a growing table'
+    )
+
+    def handle(self, *args, **kwargs):
+        self.verbosity = kwargs['verbosity']
+        if connection.vendor != 'sqlite':
+            raise CommandError('Run with USE_SQLITE=True')
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            failures = self.check_plans(self.seed())
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        if failures:
+            raise CommandError(
+                f'{failures} queries fall back to full scans')
+        self.stdout.write(self.style.SUCCESS('Query plans use indexes'))
+
+    @staticmethod
+    def seed():
+        users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com',
+                username=f'user{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+            )
+            for number in range(3)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}',
+                color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(3)
+        ]
+        for number in range(6):
+            recipe = Recipe.objects.create(
+                author=users[number % len(users)],
+                name=f'Рецепт {number}',
+                text='Описание',
+                image='recipes/images/recipe.png',
+                cooking_time=10,
+            )
+            recipe.tags.set(tags[:number % 2 + 1])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1)
+                for ingredient in ingredients[:number % 3 + 1]
+            )
+            Favorite.objects.create(user=users[0], recipe=recipe)
+            ShoppingCart.objects.create(user=users[0], recipe=recipe)
+        for author in users[1:]:
+            Subscription.objects.create(user=users[0], author=author)
+        return users[0], users[1], Recipe.objects.first(), tags[0]
+
+    def check_plans(self, seeded):
+        user, author, recipe, tag = seeded
+        token = Token.objects.create(user=user)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        urls = (
+            '/api/recipes/',
+            '/api/recipes/?cursor=',
+            '/api/recipes/?ordering=popular',
+            '/api/recipes/?ordering=trending',
+            '/api/recipes/?search=рецепт',
+            f'/api/recipes/?author={author.id}',
+            f'/api/recipes/?tags={tag.slug}',
+            '/api/recipes/?is_favorited=1',
+            '/api/recipes/?is_in_shopping_cart=1',
+            f'/api/recipes/{recipe.id}/',
+            '/api/recipes/download_shopping_cart/',
+            '/api/recipes/feed/',
+            '/api/users/',
+            '/api/users/subscriptions/?recipes_limit=3',
+            f'/api/users/{author.id}/',
+        )
+        # вторые страницы курсора: условие по всему ключу сортировки
+        urls += tuple(
+            client.get(f'{url}&cursor=&limit=2').json()['next']
+            for url in (
+                '/api/recipes/?ordering=popular',
+                '/api/recipes/?ordering=trending',
+            )
+        )
+        failures = 0
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: HTTP {response.status_code}')
+            for query in queries.captured_queries:
+                failures += self.check_query(url, query['sql'])
+        return failures
+
+    def check_query(self, url, sql):
+        if not sql.lstrip().upper().startswith('SELECT'):
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            rows = cursor.fetchall()
+        plan = [row[-1] for row in rows]
+        scans = [
+            detail for detail in plan
+            if (match := FULL_SCAN.match(detail))
+            and match.group(1) not in ALLOWED_SCANS
+        ]
+        # Строки одного SELECT в плане имеют общего родителя (row[1]).
+        sorted_levels = {row[1] for row in rows if row[-1] == TEMP_SORT}
+        scans += [
+            detail for _, parent, _, detail in rows
+            if parent in sorted_levels
+            and (match := INDEX_SCAN.match(detail))
+            and match.group(1) not in ALLOWED_SCANS
+        ]
+        if self.verbosity > 1:
+            self.stdout.write(f'{url}\n  {sql}\n  ' + '\n  '.join(plan))
+        if not scans:
+            return 0
+        self.stderr.write(f'{url}\n  {sql}\n  ' + '\n  '.join(plan))
+        return 1
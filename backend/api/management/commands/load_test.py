@@ -0,0 +1,211 @@
+import json
+import socket
+import statistics
+import threading
+import time
+from http.client import HTTPConnection
+from urllib.parse import quote, urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a running server (gunicorn sync or uvicorn workers, see '
+        'SERVER_MODE) with concurrent keep-alive clients on the read-only '
+        'routes and report throughput and p50/p95/p99 latency per '
+        'concurrency level. Ids and the token come from the database the '
+        'server uses (see generate_data). --slow-clients keeps that many '
+        'connections sending their headers byte by byte during the run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Server base URL')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+        parser.add_argument(
+            '--duration', type=float, default=10, help='Seconds per level')
+        parser.add_argument('--slow-clients', type=int, default=0)
+        parser.add_argument(
+            '--timeout', type=float, default=30, help='Request timeout')
+        parser.add_argument(
+            '--email', help='User to run as (default: the first user)')
+        parser.add_argument('--output', help='Save the results as JSON')
+        parser.add_argument(
+            '--compare', help='Results JSON to print the difference with')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        self.host, self.port = url.hostname, url.port or 80
+        self.timeout = options['timeout']
+        self.headers = {'Authorization': f'Token {self.token(options)}'}
+        self.paths = self.routes()
+
+        levels = {}
+        for concurrency in options['concurrency']:
+            stop = threading.Event()
+            slow = [
+                threading.Thread(target=self.slow_client, args=(stop,))
+                for _ in range(options['slow_clients'])
+            ]
+            for thread in slow:
+                thread.start()
+            try:
+                levels[str(concurrency)] = self.run(
+                    concurrency, options['duration'])
+            finally:
+                stop.set()
+                for thread in slow:
+                    thread.join()
+
+        results = {
+            'meta': {
+                'url': options['url'],
+                'recipes': Recipe.objects.count(),
+                'duration': options['duration'],
+                'slow_clients': options['slow_clients'],
+            },
+            'levels': levels,
+        }
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)['levels']
+        self.print_results(levels, baseline)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+
+    @staticmethod
+    def token(options):
+        user = (
+            User.objects.filter(email=options['email']).first()
+            if options['email'] else User.objects.order_by('id').first()
+        )
+        if user is None:
+            raise CommandError('No user to run as, run generate_data first')
+        token, _ = Token.objects.get_or_create(user=user)
+        return token.key
+
+    @staticmethod
+    def routes():
+        recipe = Recipe.objects.order_by('-pub_date').first()
+        tag = Tag.objects.first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        if None in (recipe, tag, ingredient):
+            raise CommandError('Not enough data, run generate_data first')
+        return [
+            '/api/recipes/',
+            f'/api/recipes/?tags={tag.slug}',
+            f'/api/recipes/{recipe.id}/',
+            '/api/tags/',
+            f'/api/ingredients/?name={quote(ingredient.name[:2])}',
+            '/api/recipes/download_shopping_cart/',
+        ]
+
+    def run(self, concurrency, duration):
+        timings = []
+        errors = []
+        deadline = time.perf_counter() + duration
+
+        def client(offset):
+            connection = None
+            index = offset
+            while time.perf_counter() < deadline:
+                path = self.paths[index % len(self.paths)]
+                index += 1
+                started = time.perf_counter()
+                try:
+                    if connection is None:
+                        connection = HTTPConnection(
+                            self.host, self.port, timeout=self.timeout)
+                    connection.request('GET', path, headers=self.headers)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, ValueError) as error:
+                    errors.append(type(error).__name__)
+                    connection = None
+                    continue
+                if response.status >= 500 or response.status == 429:
+                    errors.append(str(response.status))
+                    continue
+                # list.append атомарен, общий список без блокировки
+                timings.append((time.perf_counter() - started) * 1000)
+
+        threads = [
+            threading.Thread(target=client, args=(offset,))
+            for offset in range(concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        result = {
+            'requests': len(timings),
+            'errors': len(errors),
+            'rps': round(len(timings) / elapsed, 1),
+        }
+        if len(timings) < 2:
+            # сервер не ответил: все воркеры заняты или упали
+            return {
+                **result,
+                **dict.fromkeys(('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')),
+            }
+        percentiles = statistics.quantiles(
+            timings, n=100, method='inclusive')
+        return {
+            **result,
+            'p50_ms': round(percentiles[49], 2),
+            'p95_ms': round(percentiles[94], 2),
+            'p99_ms': round(percentiles[98], 2),
+            'max_ms': round(max(timings), 2),
+        }
+
+    def slow_client(self, stop):
+        """Держит соединение, отправляя заголовки по байту в секунду"""
+        request = (
+            f'GET /api/tags/ HTTP/1.1\r\nHost: {self.host}\r\n'
+            'X-Slow-Client: ' + 'x' * 60
+        ).encode()
+        while not stop.is_set():
+            try:
+                with socket.create_connection(
+                    (self.host, self.port), timeout=self.timeout
+                ) as sock:
+                    for position in range(len(request)):
+                        if stop.wait(1):
+                            return
+                        sock.sendall(request[position:position + 1])
+            except OSError:
+                stop.wait(1)
+
+    def print_results(self, levels, baseline):
+        self.stdout.write(
+            f'{"clients":>8}{"rps":>9}{"p50 ms":>10}{"p95 ms":>10}'
+            f'{"p99 ms":>10}{"max ms":>10}{"errors":>8}')
+        for concurrency, result in levels.items():
+            latency = ''.join(
+                f'{result[key]:>10.2f}' if result[key] is not None
+                else f'{"-":>10}'
+                for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+            )
+            line = (
+                f'{concurrency:>8}{result["rps"]:>9.1f}{latency}'
+                f'{result["errors"]:>8}'
+            )
+            old = (baseline or {}).get(concurrency)
+            if old and old['p99_ms'] and result['p99_ms']:
+                line += (
+                    f'  rps {(result["rps"] / old["rps"] - 1) * 100:+.0f}%, '
+                    f'p99 {(result["p99_ms"] / old["p99_ms"] - 1) * 100:+.0f}%'
+                )
+            self.stdout.write(line)
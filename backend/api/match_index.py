@@ -0,0 +1,205 @@
+"""Процессный инвертированный индекс «ингредиент → рецепты».
+
+Рецепты пронумерованы в порядке ленты (-pub_date, -id), множество
+рецептов — целое число-битсет: бит n означает n-й рецепт. Списки
+рецептов частых ингредиентов хранятся готовыми битсетами, редких —
+отсортированными массивами номеров (array), битсет из них собирается
+при запросе: так индекс не растёт как ингредиенты × рецепты.
+
+Подбор по ингредиентам пользователя считает для каждого рецепта число
+совпавших ингредиентов поразрядно («bit-sliced»): k-й разряд счётчика
+всех рецептов — один битсет, сложение и вычитание — побитовые операции
+над целыми, которые Python выполняет сразу над всем массивом слов.
+Число недостающих ингредиентов = размер рецепта − совпавшие; рецепты
+без единого совпадения не выдаются.
+
+Пока индекс не собран или устарел (сменилась версия
+'recipe-ingredients'), lookup() возвращает None и подбор выполняет ORM.
+"""
+from array import array
+from collections import defaultdict
+
+from core.versions import IndexHolder
+from recipes.models import IngredientRecipe, Recipe
+
+VERSION = 'recipe-ingredients'
+
+
+def bitset(positions, size):
+    """Битсет из номеров за один проход по bytearray"""
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def positions(bits, skip=0, limit=None):
+    """Номера установленных битов по возрастанию"""
+    found = []
+    while bits and (limit is None or len(found) < limit):
+        lowest = bits & -bits
+        if skip:
+            skip -= 1
+        else:
+            found.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return found
+
+
+def add(planes, bits):
+    """Прибавляет к поразрядному счётчику planes по единице в битах bits"""
+    level = 0
+    while bits:
+        if level == len(planes):
+            planes.append(0)
+        carry = planes[level] & bits
+        planes[level] ^= bits
+        bits = carry
+        level += 1
+
+
+def subtract(minuend, subtrahend, mask):
+    """Поразрядная разность счётчиков, уменьшаемое не меньше вычитаемого"""
+    result = []
+    borrow = 0
+    for level in range(len(minuend)):
+        a = minuend[level]
+        b = subtrahend[level] if level < len(subtrahend) else 0
+        result.append(a ^ b ^ borrow)
+        borrow = ((~a & (b | borrow)) | (b & borrow)) & mask
+    return result
+
+
+def equal_to(planes, value, mask):
+    """Битсет рецептов, у которых счётчик равен value"""
+    if value >> len(planes):
+        return 0
+    found = mask
+    for level, plane in enumerate(planes):
+        found &= plane if value >> level & 1 else ~plane
+    return found & mask
+
+
+class MatchResult:
+    """Совпавшие рецепты по группам «не хватает m ингредиентов».
+
+    Ленивая последовательность id для пагинатора: len() — число
+    рецептов, срез извлекает номера только нужной страницы.
+    """
+
+    def __init__(self, index, groups):
+        self.index = index
+        self.groups = [
+            (missing, bits, popcount(bits))
+            for missing, bits in groups if bits
+        ]
+
+    def __len__(self):
+        return sum(count for _, _, count in self.groups)
+
+    def __getitem__(self, item):
+        start, stop, _ = item.indices(len(self))
+        found = []
+        for missing, bits, count in self.groups:
+            if start >= count:
+                start -= count
+                stop -= count
+                continue
+            if stop <= 0:
+                break
+            found.extend(
+                (self.index.recipe_ids[position], missing)
+                for position in positions(bits, start, stop - start)
+            )
+            stop -= count
+            start = 0
+        return found
+
+
+class MatchIndex:
+    def __init__(self, rows, recipe_ids, version):
+        self.version = version
+        self.recipe_ids = array('q', recipe_ids)
+        self.size = size = len(recipe_ids)
+        position_of = {
+            recipe_id: position for position, recipe_id in enumerate(
+                recipe_ids)
+        }
+        self.mask = (1 << size) - 1
+
+        postings = defaultdict(set)
+        for ingredient_id, recipe_id in rows:
+            # рецепт мог появиться между двумя запросами сборки
+            if recipe_id in position_of:
+                postings[ingredient_id].add(position_of[recipe_id])
+        # битсет занимает len/8 байт, массив — 4 байта на рецепт
+        dense = size // 32
+        self.bitsets = {}
+        self.arrays = {}
+        counts = defaultdict(int)
+        for ingredient_id, recipes in postings.items():
+            for position in recipes:
+                counts[position] += 1
+            if len(recipes) > dense:
+                self.bitsets[ingredient_id] = bitset(recipes, size)
+            else:
+                self.arrays[ingredient_id] = array('I', sorted(recipes))
+
+        # поразрядный счётчик числа ингредиентов в каждом рецепте
+        self.sizes = []
+        by_count = defaultdict(list)
+        for position, count in counts.items():
+            by_count[count].append(position)
+        for count, recipes in by_count.items():
+            recipes = bitset(recipes, size)
+            for level in range(count.bit_length()):
+                if count >> level & 1:
+                    while len(self.sizes) <= level:
+                        self.sizes.append(0)
+                    self.sizes[level] |= recipes
+
+    def recipes_with(self, ingredient_id):
+        if ingredient_id in self.bitsets:
+            return self.bitsets[ingredient_id]
+        return bitset(self.arrays.get(ingredient_id, ()), self.size)
+
+    def match(self, ingredient_ids, max_missing=None):
+        matched = []
+        found = 0
+        for ingredient_id in set(ingredient_ids):
+            recipes = self.recipes_with(ingredient_id)
+            add(matched, recipes)
+            found |= recipes
+        missing = subtract(self.sizes, matched, self.mask)
+        largest = (1 << len(missing)) - 1
+        if max_missing is not None:
+            largest = min(largest, max_missing)
+        return MatchResult(self, (
+            (count, equal_to(missing, count, self.mask) & found)
+            for count in range(largest + 1)
+        ))
+
+
+def build(version):
+    recipe_ids = list(
+        Recipe.objects.order_by('-pub_date', '-id')
+        .values_list('id', flat=True)
+    )
+    rows = IngredientRecipe.objects.values_list(
+        'ingredient_id', 'recipe_id').iterator()
+    return MatchIndex(rows, recipe_ids, version)
+
+
+holder = IndexHolder(VERSION, build)
+
+
+def lookup(ingredient_ids, max_missing=None):
+    """MatchResult из индекса или None, если подбор должен идти в ORM"""
+    index = holder.get()
+    if index is None:
+        return None
+    return index.match(ingredient_ids, max_missing)
@@ -0,0 +1,115 @@
+import time
+from hashlib import md5
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.permissions import SAFE_METHODS
+
+from core import db
+from core.versions import get_version
+
+
+class ResponseCacheMixin:
+    """Кеш готовых JSON-ответов для справочных read-only вьюсетов.
+
+    Ключ — путь, параметры запроса и версия данных cache_version
+    (см. core.versions), поэтому сигналы на изменение модели
+    сбрасывают кеш сменой версии. Ответ отдаётся со строгим ETag,
+    If-None-Match обрабатывается до обращения к базе.
+    """
+
+    cache_version = None
+    cache_timeout = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve, *args, **kwargs)
+
+    def get_response_cache_key(self, request):
+        params = sorted(request.query_params.lists())
+        key = (
+            f'{request.path}:{params}:{request.accepted_media_type}:'
+            f'{get_version(self.cache_version)}'
+        )
+        return f'api-response:{md5(key.encode()).hexdigest()}'
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = request.accepted_renderer.render(
+                response.data,
+                request.accepted_media_type,
+                self.get_renderer_context(),
+            )
+            cached = (quote_etag(md5(content).hexdigest()), content)
+            cache.set(key, cached, self.cache_timeout)
+        etag, content = cached
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = HttpResponse(
+            content, content_type=request.accepted_media_type)
+        response['ETag'] = etag
+        return response
+
+
+class ProfilingMixin:
+    """Делит время запроса в Server-Timing на auth и view.
+
+    auth — аутентификация, права и троттлинг DRF, view — обработчик
+    действия вместе с сериализацией. Без QueryProfilingMiddleware
+    (core.profiling) ничего не делает.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        started = time.perf_counter()
+        super().initial(request, *args, **kwargs)
+        self.handler_started = time.perf_counter()
+        self.add_profile_segment(request, 'auth', started)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if hasattr(self, 'handler_started'):
+            self.add_profile_segment(request, 'view', self.handler_started)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    @staticmethod
+    def add_profile_segment(request, name, started):
+        profile = getattr(request._request, 'profile', None)
+        if profile is not None:
+            profile.add_segment(name, time.perf_counter() - started)
+
+
+class ReplicaReadMixin:
+    """Безопасные запросы читают с реплик (core.db), если пользователь
+    недавно ничего не менял; успешный изменяющий запрос закрепляет его
+    за основной базой."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not db.is_pinned(
+            request.user
+        ):
+            self.replica_token = db.replica.set(db.choose_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if hasattr(self, 'replica_token'):
+            db.replica.reset(self.replica_token)
+            del self.replica_token
+        elif (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and request.user.is_authenticated
+        ):
+            db.pin(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,5 +1,133 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    CursorPagination,
+    PageNumberPagination,
+    _reverse_ordering,
+)
+
+
+class KeysetPagination(CursorPagination):
+    """Курсор по ключу сортировки: без COUNT и без растущего OFFSET.
+
+    CursorPagination DRF ищет только по первому полю сортировки, а
+    одинаковые значения пропускает через OFFSET: при ?ordering=popular
+    почти у всех рецептов favorites_count=0, и страницы становились
+    обычным OFFSET. Здесь в курсоре все поля сортировки, последнее из
+    которых уникально (id, email), и выборка продолжается строго после
+    последней строки по всему ключу.
+    """
+
+    page_size_query_param = 'limit'
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    def decode_cursor(self, request):
+        # пустой ?cursor= открывает первую страницу
+        if not request.query_params.get(self.cursor_query_param):
+            return None
+        cursor = super().decode_cursor(request)
+        if cursor.position is None:
+            return cursor
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(position, list)
+            or len(position) != len(self.ordering)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+
+        ordering = (
+            _reverse_ordering(self.ordering) if reverse else self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = (
+            self.encode_position(results[-1])
+            if len(results) > len(self.page) else None
+        )
+        current = None if position is None else json.dumps(position)
+        if reverse:
+            self.page.reverse()
+            self.has_next = current is not None or offset > 0
+            self.has_previous = following is not None
+            self.next_position, self.previous_position = current, following
+        else:
+            self.has_next = following is not None
+            self.has_previous = current is not None or offset > 0
+            self.next_position, self.previous_position = following, current
+        if (self.has_previous or self.has_next) and self.template:
+            self.display_page_controls = True
+        return self.page
+
+    @staticmethod
+    def after(ordering, position):
+        """Строки строго после position в порядке ordering.
+
+        Для (-a, -b, -id): a <= A AND (a < A OR b <= B AND (b < B OR
+        id < ID)). Нестрогое условие на каждом уровне повторяет
+        строгое, зато по нему база ищет диапазон в индексе.
+        """
+        condition = None
+        for field, value in zip(reversed(ordering), reversed(position)):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            strict = Q(**{f'{name}__{lookup}': value})
+            if condition is None:
+                condition = strict
+                continue
+            condition = Q(**{f'{name}__{lookup}e': value}) & (
+                strict | condition)
+        return condition
+
+    def encode_position(self, instance):
+        return json.dumps([
+            str(getattr(instance, field.lstrip('-')))
+            for field in self.ordering
+        ])
+
+    def _get_position_from_instance(self, instance, ordering):
+        # get_next_link/get_previous_link DRF сравнивают позиции строк
+        return self.encode_position(instance)
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация ?page=&limit=.
+
+    Если у вьюсета задан cursor_ordering, параметр ?cursor= включает
+    курсорный режим с сортировкой по этим полям.
+    """
+
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering and self.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination(ordering)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
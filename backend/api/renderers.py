@@ -0,0 +1,167 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+from io import BytesIO
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from core import constants
+
+
+class ShoppingListRenderer(ABC, BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    stream() отдаёт файл по частям из итератора строк
+    {'name', 'measurement_unit', 'amount'}, render() нужен DRF
+    для служебных ответов (ошибки, пустая корзина).
+    """
+
+    charset = 'utf-8'
+    fields = ('name', 'measurement_unit', 'amount')
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = data.get('detail', data)
+        return f'{data}\n'.encode(self.charset)
+
+    @abstractmethod
+    def stream(self, rows):
+        """Итератор кусков файла (bytes) по строкам списка"""
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        yield f'{constants.SHOPPING_LIST_TITLE}\n'.encode(self.charset)
+        separator = ''
+        for row in rows:
+            yield (
+                f'{separator}- {row["name"]} '
+                f'({row["measurement_unit"]}) - {row["amount"]}'
+            ).encode(self.charset)
+            separator = '\n'
+
+
+class EchoBuffer:
+    """Буфер для csv.writer, который просто возвращает записанное"""
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(self.fields).encode(self.charset)
+        for row in rows:
+            yield writer.writerow(
+                [row[field] for field in self.fields]
+            ).encode(self.charset)
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+    def stream(self, rows):
+        separator = '['
+        for row in rows:
+            item = {field: row[field] for field in self.fields}
+            yield (
+                separator + json.dumps(item, ensure_ascii=False)
+            ).encode(self.charset)
+            separator = ','
+        yield ('[]' if separator == '[' else ']').encode(self.charset)
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+
+    @classmethod
+    def register_font(cls):
+        if cls.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(cls.font_name, settings.SHOPPING_LIST_PDF_FONT)
+            )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = data.get('detail', data)
+        return self.build(str(data), ())
+
+    def stream(self, rows):
+        yield self.build(constants.SHOPPING_LIST_TITLE, rows)
+
+    def build(self, title, rows):
+        """reportlab собирает документ целиком, отдаём его одним куском"""
+        self.register_font()
+        buffer = BytesIO()
+        canvas = Canvas(buffer, pagesize=A4)
+        width, height = A4
+        line_height = self.font_size * 1.5
+        canvas.setFont(self.font_name, self.font_size + 4)
+        canvas.drawString(self.margin, height - self.margin, title)
+        y = height - self.margin - line_height * 2
+        canvas.setFont(self.font_name, self.font_size)
+        for row in rows:
+            if y < self.margin:
+                canvas.showPage()
+                canvas.setFont(self.font_name, self.font_size)
+                y = height - self.margin
+            canvas.drawString(
+                self.margin,
+                y,
+                f'- {row["name"]} ({row["measurement_unit"]})'
+                f' - {row["amount"]}',
+            )
+            y -= line_height
+        canvas.save()
+        return buffer.getvalue()
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+    PDFShoppingListRenderer,
+)
+
+
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    """Формат выбирается только по ?format=, по умолчанию — текст"""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        if format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE
+        ):
+            return super().select_renderer(request, renderers, format_suffix)
+        return renderers[0], renderers[0].media_type
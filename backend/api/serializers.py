@@ -1,16 +1,28 @@
+import base64
+import binascii
+
+import filetype
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import transaction
-from django.db.models import F
+from django.db import IntegrityError, transaction
+from django.urls import reverse
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import (
+    CurrentUserDefault,
+    HiddenField,
     IntegerField,
+    ListField,
+    ListSerializer,
     ModelSerializer,
     PrimaryKeyRelatedField,
+    Serializer,
     SerializerMethodField,
 )
-from rest_framework.validators import UniqueTogetherValidator
+from rest_framework.settings import api_settings
 
+from core import constants
+from recipes import images, shopping_list
 from recipes.models import (
     Favorite,
     Ingredient,
@@ -21,6 +33,9 @@ from recipes.models import (
 )
 from users.models import Subscription
 
+from . import uploads
+from .viewer import get_viewer_relations
+
 User = get_user_model()
 
 
@@ -51,36 +66,46 @@ class UsersSerializer(ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        return bool(
-            request
-            and request.user.is_authenticated
-            and Subscription.objects.filter(
-                user=request.user.id, author=obj.id
-            ).exists()
-        )
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_viewer_relations(self.context).subscriptions
+
+
+class ConstraintCreateMixin:
+    """Повтор отсекает ограничение уникальности в базе, без отдельного
+    запроса exists(): IntegrityError становится duplicate_error"""
+
+    duplicate_error = None
 
+    def create(self, validated_data):
+        try:
+            # точка сохранения: после ошибки транзакция запроса цела
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise ValidationError(self.duplicate_error)
+
+
+class SubscribeSerializer(ConstraintCreateMixin, ModelSerializer):
+    """Автор передаётся в save(author=…), его уже загрузил вьюсет"""
+
+    user = HiddenField(default=CurrentUserDefault())
+    duplicate_error = {'detail': ['Вы уже подписанны на этого автора']}
 
-class SubscribeSerializer(ModelSerializer):
     class Meta:
         model = Subscription
         fields = (
             'user',
             'author',
         )
+        read_only_fields = ('author',)
 
-    def validate(self, data):
-        if data['user'] == data['author']:
-            raise ValidationError(
-                {'detail': 'Нельзя подписатся на самого себя'}
-            )
-        if Subscription.objects.filter(
-            user=data['user'], author=data['author']
-        ).exists():
+    def create(self, validated_data):
+        if validated_data['user'] == validated_data['author']:
             raise ValidationError(
-                {'detail': 'Вы уже подписанны на этого автора'}
+                {'detail': ['Нельзя подписатся на самого себя']}
             )
-        return data
+        return super().create(validated_data)
 
     def to_representation(self, instance):
         return SubscriptionSerializer(instance.user, context=self.context).data
@@ -95,27 +120,124 @@ class SubscriptionSerializer(UsersSerializer):
         fields = UsersSerializer.Meta.fields + ('recipes_count', 'recipes',)
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        try:
-            if limit:
-                recipes = recipes[:int(limit)]
-        except ValueError:
-            raise ValueError('limit должен быть целым числом')
+        # превью, загруженные UsersViewSet.subscriptions одним запросом
+        recipes = getattr(obj, 'recipe_previews', None)
+        if recipes is None:
+            recipes = obj.recipes.all()
+            limit = recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = RecipeData(recipes, many=True, read_only=True)
         return serializer.data
 
 
+def recipes_limit(request):
+    """Число превью рецептов из ?recipes_limit= или None"""
+    limit = request.GET.get('recipes_limit') if request else None
+    if not limit:
+        return None
+    if not limit.isdigit():
+        raise ValidationError(
+            {'recipes_limit': 'Должно быть целым неотрицательным числом'})
+    return int(limit)
+
+
+def image_srcset(recipe):
+    """srcset по форматам; для старых фото без вариантов — ссылки,
+    по которым варианты соберутся при первом запросе"""
+    if not recipe.image:
+        return None
+    if recipe.image_variants:
+        return images.srcset(recipe.image_variants)
+    return {
+        extension: ', '.join(
+            reverse('api:recipe-image', kwargs={
+                'pk': recipe.pk, 'width': width, 'extension': extension,
+            }) + f' {width}w'
+            for width in images.VARIANT_WIDTHS
+        )
+        for extension in images.FORMATS
+    }
+
+
+class Base64ImageUploadField(Base64ImageField):
+    """Фото рецепта.
+
+    По умолчанию (IMAGE_UPLOAD_ASYNC) в запросе проверяются только
+    размер base64 и сигнатура формата по первым байтам, а декодирование,
+    проверку Pillow и запись выполняет пул api.uploads. Без фоновой
+    обработки фото декодируется и проверяется здесь целиком.
+    """
+
+    def to_internal_value(self, data):
+        if not settings.IMAGE_UPLOAD_ASYNC:
+            return self.decode(data)
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        payload = data.rpartition(';base64,')[2]
+        if len(payload) * 3 // 4 > settings.IMAGE_UPLOAD_MAX_BYTES:
+            raise ValidationError(
+                f'Изображение больше {settings.IMAGE_UPLOAD_MAX_BYTES} байт')
+        try:
+            head = base64.b64decode(payload[:uploads.HEAD_CHARS])
+        except (binascii.Error, ValueError):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        extension = filetype.guess_extension(head)
+        if extension not in self.ALLOWED_TYPES:
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        name = f'{self.get_file_name(head)}.{extension}'
+        return uploads.Payload(name, payload)
+
+    def decode(self, data):
+        upload = super().to_internal_value(data)
+        if upload is None:
+            return None
+        # Django ImageField оставляет открытую Pillow картинку, по
+        # заголовку размер известен без декодирования пикселей
+        width, height = upload.image.size
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            raise ValidationError(
+                f'Изображение больше '
+                f'{settings.IMAGE_UPLOAD_MAX_PIXELS} пикселей'
+            )
+        return upload
+
+
 class RecipeData(ModelSerializer):
     image = Base64ImageField()
+    image_srcset = SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_srcset', 'cooking_time')
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj)
+
+
+class IngredientRecipeListSerializer(ListSerializer):
+    """Существование всех ингредиентов списка проверяет один запрос"""
+
+    def to_internal_value(self, data):
+        ids = set()
+        if isinstance(data, list):
+            id_field = self.child.fields['id']
+            for item in data:
+                try:
+                    ids.add(id_field.to_internal_value(item['id']))
+                except (KeyError, TypeError, ValidationError):
+                    # ошибку формата сообщит поле id
+                    continue
+        self.existing_ids = set(
+            Ingredient.objects.filter(id__in=ids)
+            .values_list('id', flat=True)
+        )
+        return super().to_internal_value(data)
 
 
 class IngredientRecipeSerializer(ModelSerializer):
@@ -124,9 +246,10 @@ class IngredientRecipeSerializer(ModelSerializer):
     class Meta:
         model = IngredientRecipe
         fields = ('id', 'amount')
+        list_serializer_class = IngredientRecipeListSerializer
 
     def validate_id(self, value):
-        if not Ingredient.objects.filter(id=value).exists():
+        if value not in self.parent.existing_ids:
             raise ValidationError(f'Ингредиент с id={value} не существует')
         return value
 
@@ -135,6 +258,7 @@ class RecipeSerializer(ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = UsersSerializer(read_only=True)
     image = SerializerMethodField(read_only=True)
+    image_srcset = SerializerMethodField(read_only=True)
     ingredients = SerializerMethodField()
     is_favorited = SerializerMethodField(read_only=True)
     is_in_shopping_cart = SerializerMethodField(read_only=True)
@@ -150,6 +274,8 @@ class RecipeSerializer(ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_srcset',
+            'image_status',
             'text',
             'cooking_time'
         )
@@ -159,31 +285,29 @@ class RecipeSerializer(ModelSerializer):
             return obj.image.url
         return None
 
+    def get_image_srcset(self, obj):
+        return image_srcset(obj)
+
     def get_ingredients(self, obj):
-        return obj.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('ingredient_recipe__amount')
-        )
+        return [
+            {
+                'id': item.ingredient.id,
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in obj.ingredient_recipe.all()
+        ]
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        user = request.user
-        return bool(
-            request
-            and request.user.is_authenticated
-            and user.favorites.filter(recipe=obj).exists()
-        )
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return obj.id in get_viewer_relations(self.context).favorites
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        user = request.user
-        return bool(
-            request
-            and request.user.is_authenticated
-            and user.shopping_cart.filter(recipe=obj).exists()
-        )
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.id in get_viewer_relations(self.context).shopping_cart
 
 
 class RecipeCreateUpdateDeleteSerializer(ModelSerializer):
@@ -192,7 +316,7 @@ class RecipeCreateUpdateDeleteSerializer(ModelSerializer):
         queryset=Tag.objects.all(),
         many=True
     )
-    image = Base64ImageField()
+    image = Base64ImageUploadField()
     author = UsersSerializer(read_only=True)
 
     class Meta:
@@ -210,6 +334,11 @@ class RecipeCreateUpdateDeleteSerializer(ModelSerializer):
 
     def to_representation(self, instance):
         request = self.context.get('request')
+        instance = (
+            Recipe.objects.with_related()
+            .with_user_flags(request.user)
+            .get(pk=instance.pk)
+        )
         serializer = RecipeSerializer(
             instance, context={'request': request}
         )
@@ -225,25 +354,55 @@ class RecipeCreateUpdateDeleteSerializer(ModelSerializer):
             ) for ingredient in ingredients
         )
 
+    @staticmethod
+    def process_image(validated_data):
+        """Очищенный оригинал и уменьшенные копии из одного декодирования.
+        При IMAGE_UPLOAD_ASYNC вернёт base64 фото для фоновой
+        обработки, фото рецепта до её конца остаётся прежним"""
+        upload = validated_data.pop('image')
+        if settings.IMAGE_UPLOAD_ASYNC:
+            validated_data['image_status'] = Recipe.IMAGE_PENDING
+            return upload
+        image = images.open_image(upload)
+        validated_data['image'] = images.clean_original(image, upload.name)
+        validated_data['image_variants'] = images.build_variants(
+            image, upload.name)
+        validated_data['image_status'] = Recipe.IMAGE_READY
+        return None
+
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         validated_data['author'] = self.context['request'].user
+        payload = self.process_image(validated_data)
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.add_ingredients(ingredients, recipe)
+        if payload:
+            uploads.submit(recipe.id, payload)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
+        old_amounts = shopping_list.recipe_amounts(instance.id)
         IngredientRecipe.objects.filter(recipe=instance).delete()
         ingredients = validated_data.pop('ingredients')
         self.add_ingredients(ingredients, instance)
+        shopping_list.update_recipe(instance.id, old_amounts)
 
         tags = validated_data.pop('tags')
         instance.tags.set(tags)
 
+        if 'image' in validated_data:
+            old_variants = instance.image_variants
+            payload = self.process_image(validated_data)
+            if payload:
+                # старые варианты удалит фоновая обработка
+                uploads.submit(instance.id, payload)
+            else:
+                transaction.on_commit(
+                    lambda: images.delete_variants(old_variants))
         return super().update(instance, validated_data)
 
     def validate(self, data):
@@ -260,31 +419,30 @@ class RecipeCreateUpdateDeleteSerializer(ModelSerializer):
                 'Теги не должны дублироваться'
             )
 
-        ingredients_list = []
-        for ingredient in ingredients:
-            if ingredient in ingredients_list:
-                raise ValidationError(
-                    'Ингредиенты не должны дублироваться'
-                )
-            ingredients_list.append(ingredient)
+        unique_ingredients = {
+            (ingredient['id'], ingredient['amount'])
+            for ingredient in ingredients
+        }
+        if len(unique_ingredients) != len(ingredients):
+            raise ValidationError(
+                'Ингредиенты не должны дублироваться'
+            )
 
         return data
 
 
-class FavoriteSerializer(ModelSerializer):
+class FavoriteSerializer(ConstraintCreateMixin, ModelSerializer):
+    user = HiddenField(default=CurrentUserDefault())
+    duplicate_error = {
+        api_settings.NON_FIELD_ERRORS_KEY: ['Рецепт уже добавлен в избранное']
+    }
+
     class Meta:
         model = Favorite
         fields = (
             'recipe',
             'user',
         )
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Favorite.objects.all(),
-                fields=('recipe', 'user'),
-                message='Рецепт уже добавлен в избранное',
-            )
-        ]
 
     def to_representation(self, instance):
         return RecipeData(
@@ -292,22 +450,30 @@ class FavoriteSerializer(ModelSerializer):
         ).data
 
 
-class ShoppingCartSerializer(ModelSerializer):
+class ShoppingCartSerializer(ConstraintCreateMixin, ModelSerializer):
+    # вместе со строкой корзины в той же точке сохранения
+    # обновляется список покупок
+    user = HiddenField(default=CurrentUserDefault())
+    duplicate_error = {
+        api_settings.NON_FIELD_ERRORS_KEY: ['Рецепт уже добавлен в корзину']
+    }
+
     class Meta:
         model = ShoppingCart
         fields = (
             'recipe',
             'user',
         )
-        validators = [
-            UniqueTogetherValidator(
-                queryset=ShoppingCart.objects.all(),
-                fields=('recipe', 'user'),
-                message='Рецепт уже добавлен в корзину',
-            )
-        ]
 
     def to_representation(self, instance):
         return RecipeData(
             instance.recipe, context=self.context
         ).data
+
+
+class RecipeBatchSerializer(Serializer):
+    recipes = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=constants.BATCH_MAX_RECIPES,
+    )
@@ -0,0 +1,645 @@
+import base64
+import tempfile
+import time
+import warnings
+from io import BytesIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from core import counters
+from core.db import ReplicaRouter
+from core.versions import get_version
+from recipes import batch, images, shopping_list
+from recipes.models import (
+    Favorite,
+    FeedEntry,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+)
+from users import authentication
+from users.models import Subscription
+
+from . import ingredient_index, uploads
+
+User = get_user_model()
+
+
+class RecipeDataMixin:
+    """Авторы, их рецепты с тегами и ингредиентами и читатель, у
+    которого часть рецептов в избранном и корзине"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = cls.create_user('reader')
+        cls.authors = [
+            cls.create_user(f'author{number}') for number in range(3)]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipes = [cls.create_recipe(number) for number in range(6)]
+        Subscription.objects.create(user=cls.reader, author=cls.authors[0])
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipes[1])
+
+    @staticmethod
+    def create_user(name):
+        return User.objects.create_user(
+            username=name, email=f'{name}@example.com', password='password',
+            first_name=name, last_name=name,
+        )
+
+    @classmethod
+    def create_recipe(cls, number):
+        recipe = Recipe.objects.create(
+            author=cls.authors[number % len(cls.authors)],
+            name=f'Рецепт {number}',
+            text='Описание',
+            image='recipes/images/test.png',
+            cooking_time=10,
+        )
+        recipe.tags.set(cls.tags)
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=5)
+            for ingredient in cls.ingredients
+        )
+        return recipe
+
+    def setUp(self):
+        # кеш токенов и версий не должен переносить запросы между тестами
+        cache.clear()
+
+
+class RecipeReadQueriesTest(RecipeDataMixin, APITestCase):
+    """Список и карточка рецепта — постоянное число запросов"""
+
+    def assert_queries(self, count, path, user=None):
+        if user is not None:
+            self.client.force_authenticate(user)
+        with self.assertNumQueries(count):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list_anonymous(self):
+        self.assert_queries(4, '/api/recipes/')
+
+    def test_list_authenticated(self):
+        response = self.assert_queries(
+            5, '/api/recipes/', self.reader)
+        flags = {
+            item['id']: (
+                item['is_favorited'], item['is_in_shopping_cart'],
+                item['author']['is_subscribed'],
+            )
+            for item in response.data['results']
+        }
+        self.assertEqual(flags[self.recipes[0].id], (True, False, True))
+        self.assertEqual(flags[self.recipes[1].id], (False, True, False))
+
+    def test_list_does_not_grow_with_page(self):
+        for number in range(6, 12):
+            self.create_recipe(number)
+        self.assert_queries(
+            5, '/api/recipes/?limit=12', self.reader)
+
+    def test_detail_anonymous(self):
+        self.assert_queries(
+            3, f'/api/recipes/{self.recipes[0].id}/')
+
+    def test_detail_authenticated(self):
+        self.assert_queries(
+            4, f'/api/recipes/{self.recipes[0].id}/',
+            self.reader)
+
+
+class MutationQueriesTest(RecipeDataMixin, APITestCase):
+    """Число запросов изменяющих запросов: повтор и отсутствие строки
+    отсекает база, а не отдельный exists()"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+
+    def assert_queries(self, count, method, path, status_code, data=None):
+        with self.assertNumQueries(count):
+            response = getattr(self.client, method)(
+                path, data, format='json')
+        self.assertEqual(response.status_code, status_code)
+        return response
+
+    def test_favorite(self):
+        recipe = self.recipes[2]
+        self.assert_queries(
+            11, 'post', f'/api/recipes/{recipe.id}/favorite/', 201)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_favorite_repeat(self):
+        response = self.assert_queries(
+            5, 'post', f'/api/recipes/{self.recipes[0].id}/favorite/', 400)
+        self.assertEqual(
+            response.data['non_field_errors'],
+            ['Рецепт уже добавлен в избранное'],
+        )
+
+    def test_unfavorite(self):
+        recipe = self.recipes[0]
+        self.assert_queries(
+            3, 'delete', f'/api/recipes/{recipe.id}/favorite/', 204)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+
+    def test_unfavorite_absent(self):
+        self.assert_queries(
+            2, 'delete', f'/api/recipes/{self.recipes[2].id}/favorite/', 400)
+
+    def test_cart_add(self):
+        recipe = self.recipes[2]
+        self.assert_queries(
+            15, 'post', f'/api/recipes/{recipe.id}/shopping_cart/', 201)
+        self.assertEqual(self.shopping_list(), {
+            ingredient.id: 10 for ingredient in self.ingredients})
+
+    def test_cart_remove(self):
+        recipe = self.recipes[1]
+        self.assert_queries(
+            6, 'delete', f'/api/recipes/{recipe.id}/shopping_cart/', 204)
+        self.assertEqual(self.shopping_list(), {
+            ingredient.id: 0 for ingredient in self.ingredients})
+
+    def test_subscribe(self):
+        author = self.authors[1]
+        self.assert_queries(
+            10, 'post', f'/api/users/{author.id}/subscribe/', 201)
+        author.refresh_from_db()
+        self.assertEqual(author.subscribers_count, 1)
+
+    def test_subscribe_repeat(self):
+        response = self.assert_queries(
+            5, 'post', f'/api/users/{self.authors[0].id}/subscribe/', 400)
+        self.assertEqual(
+            response.data['detail'], ['Вы уже подписанны на этого автора'])
+
+    def test_unsubscribe(self):
+        author = self.authors[0]
+        self.assert_queries(
+            4, 'delete', f'/api/users/{author.id}/subscribe/', 204)
+        author.refresh_from_db()
+        self.assertEqual(author.subscribers_count, 0)
+        self.assertFalse(self.reader.feed.filter(author=author).exists())
+
+    def shopping_list(self):
+        return dict(
+            self.reader.shopping_list.values_list('ingredient_id', 'amount'))
+
+
+class BatchTest(RecipeDataMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+
+    def post_cart(self, recipes, method='post'):
+        return getattr(self.client, method)(
+            '/api/recipes/shopping_cart/',
+            {'recipes': [recipe.id for recipe in recipes]}, format='json',
+        )
+
+    def test_queries_do_not_grow_with_batch(self):
+        with self.assertNumQueries(18):
+            self.post_cart(self.recipes[2:3])
+        with self.assertNumQueries(18):
+            self.post_cart(self.recipes[3:])
+
+    def test_remove_queries_do_not_grow_with_batch(self):
+        self.post_cart(self.recipes[2:])
+        with self.assertNumQueries(10):
+            self.post_cart(self.recipes[2:3], 'delete')
+        with self.assertNumQueries(10):
+            self.post_cart(self.recipes[3:], 'delete')
+        self.assertFalse(
+            ShoppingCart.objects.filter(recipe__in=self.recipes[2:]).exists())
+
+    def test_row_inserted_meanwhile_is_not_counted(self):
+        """Строку, которую одиночный запрос вставил после выборки
+        пакета, пакет не считает своей"""
+        recipe = self.recipes[2]
+        present = batch.present
+
+        def stale_present(*args, **kwargs):
+            if not ShoppingCart.objects.filter(recipe=recipe).exists():
+                ShoppingCart.objects.create(user=self.reader, recipe=recipe)
+                return set()
+            return present(*args, **kwargs)
+
+        with mock.patch.object(batch, 'present', stale_present):
+            response = self.post_cart([recipe])
+        self.assertEqual(
+            response.data['results'], [{'id': recipe.id, 'status': 'exists'}])
+        # рецепт 1 уже был в корзине, рецепт 2 учтён один раз
+        self.assertEqual(
+            dict(self.reader.shopping_list.values_list(
+                'ingredient_id', 'amount')),
+            {ingredient.id: 10 for ingredient in self.ingredients},
+        )
+
+
+class KeysetPaginationTest(RecipeDataMixin, APITestCase):
+    """Курсор проходит одинаковые значения сортировки без OFFSET"""
+
+    def walk(self, path, link='next'):
+        ids, offsets = [], 0
+        while path:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            offsets += sum(
+                'OFFSET' in query['sql'] for query in queries)
+            page = [item['id'] for item in response.data['results']]
+            ids = ids + page if link == 'next' else page + ids
+            last, path = response.data, response.data[link]
+        self.assertEqual(offsets, 0)
+        return ids, last
+
+    def test_popular_ties(self):
+        # у всех рецептов, кроме одного, favorites_count одинаковый
+        Recipe.objects.filter(id=self.recipes[3].id).update(
+            favorites_count=1)
+        expected = [
+            item['id'] for item in self.client.get(
+                '/api/recipes/?ordering=popular&limit=100'
+            ).data['results']
+        ]
+        ids, last = self.walk('/api/recipes/?ordering=popular&cursor=&limit=2')
+        self.assertEqual(ids, expected)
+        ids, _ = self.walk(last['previous'], 'previous')
+        self.assertEqual(ids, expected[:-2])
+
+
+class FeedTest(RecipeDataMixin, APITestCase):
+    """Лента: страницы по курсору, слияние с авторами выше
+    FEED_FANOUT_LIMIT и записи, оставшиеся с тех пор, когда автор был
+    ниже порога"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+
+    def walk(self, limit):
+        ids, path = [], f'/api/recipes/feed/?limit={limit}'
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.data['results']]
+            path = response.data['next']
+        return ids
+
+    @staticmethod
+    def expected(*authors):
+        return list(
+            Recipe.objects.filter(author__in=authors)
+            .order_by('-pub_date', '-id').values_list('id', flat=True)
+        )
+
+    def make_popular(self, author):
+        # подписчиков больше порога, рецепты читаются при запросе
+        User.objects.filter(id=author.id).update(subscribers_count=5)
+
+    def test_cursor_pages(self):
+        Subscription.objects.create(user=self.reader, author=self.authors[1])
+        expected = self.expected(self.authors[0], self.authors[1])
+        self.assertEqual(len(expected), 4)
+        for limit in (1, 3, 10):
+            self.assertEqual(self.walk(limit), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/feed/?cursor=broken')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_fan_out_on_read_merged(self):
+        author = self.authors[1]
+        self.make_popular(author)
+        Subscription.objects.create(user=self.reader, author=author)
+        self.create_recipe(4)
+        self.assertFalse(FeedEntry.objects.filter(author=author).exists())
+        expected = self.expected(self.authors[0], author)
+        self.assertEqual(len(expected), 5)
+        for limit in (1, 2, 10):
+            self.assertEqual(self.walk(limit), expected)
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_no_duplicates_after_crossing_limit(self):
+        author = self.authors[0]
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.reader, author=author).exists())
+        self.make_popular(author)
+        expected = self.expected(author)
+        for limit in (1, 2, 10):
+            self.assertEqual(self.walk(limit), expected)
+
+
+def png_base64(size=(40, 30)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 10, 10)).save(buffer, 'PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+@override_settings(
+    IMAGE_UPLOAD_ASYNC=True, MEDIA_ROOT=tempfile.mkdtemp())
+class AsyncUploadTest(RecipeDataMixin, APITestCase):
+    """Запрос проверяет размер и сигнатуру, остальное — пул"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.authors[0])
+
+    def post_recipe(self, image):
+        return self.client.post('/api/recipes/', {
+            'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+            'name': 'Рецепт с фото',
+            'text': 'Описание',
+            'image': f'data:image/png;base64,{image}',
+            'cooking_time': 5,
+        }, format='json')
+
+    def test_pending_without_decoding(self):
+        with mock.patch.object(uploads, 'submit') as submit, \
+                mock.patch('recipes.images.open_image') as open_image:
+            response = self.post_recipe(png_base64())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['image_status'], 'pending')
+        open_image.assert_not_called()
+        recipe_id, payload = submit.call_args.args
+        self.assertEqual(recipe_id, response.data['id'])
+        self.assertTrue(payload.name.endswith('.png'))
+
+    def test_not_an_image(self):
+        text = base64.b64encode(b'not an image at all').decode()
+        self.assertEqual(self.post_recipe(text).status_code, 400)
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_too_many_bytes(self):
+        self.assertEqual(self.post_recipe(png_base64()).status_code, 400)
+
+    def process(self, data):
+        recipe = self.recipes[0]
+        uploads.run(recipe.id, uploads.Payload('photo.png', data))
+        recipe.refresh_from_db()
+        return recipe
+
+    def test_worker_stores_variants(self):
+        recipe = self.process(png_base64((400, 300)))
+        self.assertEqual(recipe.image_status, 'ready')
+        self.assertEqual(set(recipe.image_variants), {'webp', 'jpeg'})
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100)
+    def test_worker_rejects_too_many_pixels(self):
+        with self.assertLogs(uploads.logger, 'WARNING'):
+            recipe = self.process(png_base64())
+        self.assertEqual(recipe.image_status, 'failed')
+
+    def test_worker_rejects_broken_image(self):
+        # сигнатура PNG верна, данные обрезаны
+        with self.assertLogs(uploads.logger, 'WARNING'):
+            recipe = self.process(png_base64()[:60])
+        self.assertEqual(recipe.image_status, 'failed')
+
+
+class DataVersionTest(APITestCase):
+    """Версия справочника меняется только после коммита"""
+
+    def assert_bumped_on_commit(self, name, change):
+        cache.clear()
+        before = get_version(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+            self.assertEqual(get_version(name), before)
+        self.assertNotEqual(get_version(name), before)
+
+    def test_tag(self):
+        self.assert_bumped_on_commit('tags', lambda: Tag.objects.create(
+            name='Тег', color='#000000', slug='tag'))
+
+    def test_ingredient(self):
+        self.assert_bumped_on_commit(
+            'ingredients', lambda: Ingredient.objects.create(
+                name='соль', measurement_unit='г'))
+
+
+class IngredientAutocompleteTest(APITestCase):
+    """Индекс и запрос к базе находят одни и те же ингредиенты"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Соль', 'соус', 'Sugar', 'sugar syrup', 'Сахар'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def names(self, query, index):
+        cache.clear()
+        holder = ingredient_index.holder
+        built = ingredient_index.build(get_version(holder.name))
+        with mock.patch.object(
+            holder, 'get', return_value=built if index else None
+        ):
+            response = self.client.get('/api/ingredients/', query)
+        return [item['name'] for item in response.json()]
+
+    def test_same_results(self):
+        cases = (
+            ({'name': 's'}, ['sugar syrup']),
+            ({'name': 'S'}, ['Sugar']),
+            ({'name': 'с'}, ['соус']),
+            ({'name__istartswith': 'SU'}, ['Sugar', 'sugar syrup']),
+            ({'name__istartswith': 'СО'}, ['Соль', 'соус']),
+            ({'name__istartswith': 'с', 'name': 'С'}, ['Сахар', 'Соль']),
+        )
+        for query, expected in cases:
+            for index in (True, False):
+                with self.subTest(query=query, index=index):
+                    self.assertEqual(self.names(query, index), expected)
+
+
+class TokenCacheTest(RecipeDataMixin, APITestCase):
+    """Выход и деактивация действуют со следующего запроса, даже если
+    запрос до коммита снова положил пользователя в кеш"""
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.reader)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def status(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def test_deactivation(self):
+        self.assertEqual(self.status(), 200)
+        key = authentication.cache_key(self.token.key)
+        cached = cache.get(key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reader.is_active = False
+            self.reader.save()
+            # параллельный запрос до коммита кеширует прежнюю строку
+            cache.set(key, cached)
+        self.assertEqual(self.status(), 401)
+
+    def test_logout(self):
+        self.assertEqual(self.status(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.status(), 401)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class SharedVariantsTest(RecipeDataMixin, APITestCase):
+    """Варианты, общие для нескольких рецептов, не удаляются, пока на
+    них ссылается хоть один"""
+
+    def test_kept_while_referenced(self):
+        manifest = images.build_variants(
+            Image.new('RGB', (400, 300)), 'shared.png')
+        paths = [
+            path for variants in manifest.values()
+            for path in variants.values()
+        ]
+        Recipe.objects.filter(
+            id__in=[self.recipes[0].id, self.recipes[1].id]
+        ).update(image_variants=manifest)
+
+        Recipe.objects.filter(id=self.recipes[0].id).update(
+            image_variants={})
+        images.delete_variants(manifest)
+        self.assertTrue(all(map(default_storage.exists, paths)))
+
+        Recipe.objects.filter(id=self.recipes[1].id).update(
+            image_variants={})
+        images.delete_variants(manifest)
+        self.assertFalse(any(map(default_storage.exists, paths)))
+
+
+class CounterSaveTest(RecipeDataMixin, APITestCase):
+    """save() загруженной строки не затирает параллельный инкремент"""
+
+    def test_recipe(self):
+        recipe = Recipe.objects.get(id=self.recipes[2].id)
+        counters.increment(Recipe, recipe.id, 'favorites_count')
+        counters.increment(Recipe, recipe.id, 'trending')
+        recipe.name = 'Новое название'
+        recipe.save()
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.name, recipe.favorites_count, recipe.trending),
+            ('Новое название', 1, 1),
+        )
+
+    def test_recipe_update_request(self):
+        recipe = self.recipes[0]
+        self.client.force_authenticate(self.authors[0])
+
+        def favorite_meanwhile(*args):
+            # избранное добавили, пока запрос правил рецепт
+            counters.increment(Recipe, recipe.id, 'favorites_count')
+
+        with mock.patch.object(
+            shopping_list, 'update_recipe', side_effect=favorite_meanwhile
+        ):
+            response = self.client.patch(f'/api/recipes/{recipe.id}/', {
+                'tags': [self.tags[0].id],
+                'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+                'name': 'Новое название',
+                'text': 'Описание',
+                'cooking_time': 5,
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 2)
+
+    def test_user(self):
+        author = User.objects.get(id=self.authors[1].id)
+        counters.increment(User, author.id, 'subscribers_count')
+        author.first_name = 'Имя'
+        author.save()
+        author.refresh_from_db()
+        self.assertEqual(
+            (author.first_name, author.subscribers_count), ('Имя', 1))
+
+
+class ReplicaReadTest(RecipeDataMixin, APITestCase):
+    """Безопасные запросы читают с реплики, изменяющий запрос
+    закрепляет пользователя за основной базой на REPLICA_PIN_SECONDS"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+        override = override_settings(DATABASES={
+            **settings.DATABASES, 'replica1': settings.DATABASES['default'],
+        })
+        with warnings.catch_warnings():
+            # Django предупреждает о подмене DATABASES
+            warnings.simplefilter('ignore')
+            override.enable()
+        self.addCleanup(override.disable)
+        # реплика — то же соединение, что default: запросы видят данные
+        # теста, а куда их направил роутер, записывает reads()
+        connections['replica1'] = connections['default']
+        self.addCleanup(connections.__delitem__, 'replica1')
+
+    def reads(self, method, path):
+        """Алиасы, на которые роутер направил чтения запроса"""
+        aliases = set()
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            alias = db_for_read(router, model, **hints)
+            aliases.add(alias)
+            return alias
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', record):
+            response = getattr(self.client, method)(path)
+        self.assertLess(response.status_code, 400)
+        return aliases
+
+    def test_safe_reads_use_replica(self):
+        self.assertEqual(self.reads('get', '/api/recipes/'), {'replica1'})
+        self.assertEqual(
+            self.reads('get', f'/api/recipes/{self.recipes[0].id}/'),
+            {'replica1'},
+        )
+
+    def test_write_pins_to_default(self):
+        path = f'/api/recipes/{self.recipes[2].id}/favorite/'
+        self.assertEqual(self.reads('post', path), {'default'})
+        self.assertEqual(self.reads('get', '/api/recipes/'), {'default'})
+        # закреплён только тот, кто менял данные
+        self.client.force_authenticate(self.authors[0])
+        self.assertEqual(self.reads('get', '/api/recipes/'), {'replica1'})
+
+    def test_pin_expires(self):
+        self.reads('post', f'/api/recipes/{self.recipes[2].id}/favorite/')
+        later = time.time() + settings.REPLICA_PIN_SECONDS + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(self.reads('get', '/api/recipes/'), {'replica1'})
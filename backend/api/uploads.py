@@ -0,0 +1,108 @@
+"""Фоновая обработка фото рецептов.
+
+Включена по умолчанию (IMAGE_UPLOAD_ASYNC). Запрос проверяет только
+размер base64 и сигнатуру формата по первым байтам
+(api.serializers), поэтому его время не зависит от размера фото.
+Рецепт сохраняется сразу со статусом фото 'pending', а base64 уходит
+в пул потоков процесса. Там он декодируется, Pillow проверяет формат
+и число пикселей, пишутся очищенный оригинал и варианты
+(recipes.images), после чего фото подменяется в рецепте одним UPDATE
+со статусом 'ready'. Битое или слишком большое фото получает статус
+'failed': клиент видит его в image_status рецепта, прежнее фото
+остаётся, а новый рецепт остаётся без фото, пока его не загрузят
+заново.
+
+Пул ограничен: IMAGE_UPLOAD_WORKERS потоков и не больше
+IMAGE_UPLOAD_QUEUE ожидающих фото на процесс, иначе фото
+обрабатывается в самом запросе — так память под файлы не растёт без
+предела. Ожидающие фото хранятся только в памяти процесса:
+после его перезапуска такие рецепты остаются 'pending', пока автор не
+загрузит фото заново.
+"""
+import base64
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from recipes import images
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# столько символов base64 (192 байта) хватает на сигнатуру формата
+HEAD_CHARS = 256
+
+# фото из запроса: имя файла и ещё не декодированный base64
+Payload = namedtuple('Payload', 'name data')
+
+pool = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_UPLOAD_WORKERS,
+    thread_name_prefix='image-upload',
+)
+slots = threading.BoundedSemaphore(settings.IMAGE_UPLOAD_QUEUE)
+
+
+def process(recipe_id, payload):
+    recipe = Recipe.objects.only('image', 'image_variants').get(
+        pk=recipe_id)
+    old_variants = recipe.image_variants
+    upload = ContentFile(
+        base64.b64decode(payload.data, validate=True), name=payload.name)
+    image = images.open_image(upload, settings.IMAGE_UPLOAD_MAX_PIXELS)
+    variants = images.build_variants(image, upload.name)
+    field = recipe.image
+    field.save(
+        upload.name, images.clean_original(image, upload.name), save=False)
+    updated = Recipe.objects.filter(pk=recipe_id).update(
+        image=field.name,
+        image_variants=variants,
+        image_status=Recipe.IMAGE_READY,
+    )
+    if updated:
+        images.delete_variants(old_variants)
+    else:
+        # рецепт удалили, пока фото обрабатывалось
+        field.storage.delete(field.name)
+        images.delete_variants(variants)
+
+
+def run(recipe_id, payload):
+    try:
+        process(recipe_id, payload)
+    except Recipe.DoesNotExist:
+        return
+    except (OSError, ValueError) as error:
+        # битый base64 или картинка, либо слишком много пикселей
+        logger.warning('Фото рецепта %s отклонено: %s', recipe_id, error)
+    except Exception:
+        logger.exception('Фото рецепта %s не обработано', recipe_id)
+    else:
+        return
+    Recipe.objects.filter(pk=recipe_id).update(
+        image_status=Recipe.IMAGE_FAILED)
+
+
+def work(recipe_id, payload):
+    try:
+        run(recipe_id, payload)
+    finally:
+        slots.release()
+        # у каждого потока пула своё соединение с базой
+        connection.close()
+
+
+def submit(recipe_id, payload):
+    """Обработать фото после коммита транзакции, в которой сохранён
+    рецепт со статусом 'pending'"""
+    def start():
+        if slots.acquire(blocking=False):
+            pool.submit(work, recipe_id, payload)
+        else:
+            run(recipe_id, payload)
+
+    transaction.on_commit(start)
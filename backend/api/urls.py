@@ -1,7 +1,13 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UsersViewSet
+from .views import (
+    IngredientViewSet,
+    ProfilingView,
+    RecipeViewSet,
+    TagViewSet,
+    UsersViewSet,
+)
 
 app_name = 'api'
 
@@ -13,6 +19,7 @@ router.register('recipes', RecipeViewSet, basename='recipe')
 router.register('ingredients', IngredientViewSet, basename='ingredient')
 
 urlpatterns = [
+    path('profiling/', ProfilingView.as_view(), name='profiling'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -0,0 +1,48 @@
+from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import cached_property
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscription
+
+
+class ViewerRelations:
+    """Связи текущего пользователя, загруженные один раз на запрос.
+
+    Каждый набор id читается одним запросом при первом обращении,
+    дальше флаги is_subscribed/is_favorited/is_in_shopping_cart
+    проверяются поиском по множеству.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def _ids(self, queryset, field):
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(
+            queryset.filter(user=self.user).values_list(field, flat=True)
+        )
+
+    @cached_property
+    def subscriptions(self):
+        return self._ids(Subscription.objects, 'author_id')
+
+    @cached_property
+    def favorites(self):
+        return self._ids(Favorite.objects, 'recipe_id')
+
+    @cached_property
+    def shopping_cart(self):
+        return self._ids(ShoppingCart.objects, 'recipe_id')
+
+
+def get_viewer_relations(context):
+    """Общий для всех вложенных сериализаторов объект связей запроса"""
+    request = context.get('request')
+    if request is None:
+        return ViewerRelations(AnonymousUser())
+    relations = getattr(request, '_viewer_relations', None)
+    if relations is None:
+        relations = ViewerRelations(request.user)
+        request._viewer_relations = relations
+    return relations
@@ -1,36 +1,53 @@
+from hashlib import md5
+
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import (
+    BooleanField,
+    Count,
+    F,
+    Max,
+    Prefetch,
+    Q,
+    Sum,
+    Value,
+    prefetch_related_objects,
+)
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import filters, status
 from rest_framework.decorators import action
 from rest_framework.permissions import (
     SAFE_METHODS,
+    IsAdminUser,
     IsAuthenticated,
     IsAuthenticatedOrReadOnly,
 )
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from core import constants
-from recipes.models import (
-    Favorite,
-    Ingredient,
-    IngredientRecipe,
-    Recipe,
-    ShoppingCart,
-    Tag,
-)
+from core import constants, profiling
+from recipes import batch, feed, images
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
 from users.models import Subscription
 
+from . import ingredient_index, match_index
 from .filters import IngredientFilter, RecipeFilter
+from .mixins import ProfilingMixin, ReplicaReadMixin, ResponseCacheMixin
 from .pagination import CustomPagination
 from .permissions import IsAuthorOrReadOnly
+from .renderers import SHOPPING_LIST_RENDERERS, ShoppingListNegotiation
 from .serializers import (
     FavoriteSerializer,
     IngredientSerializer,
+    RecipeBatchSerializer,
     RecipeCreateUpdateDeleteSerializer,
     RecipeSerializer,
     ShoppingCartSerializer,
@@ -38,15 +55,17 @@ from .serializers import (
     SubscriptionSerializer,
     TagSerializer,
     UsersSerializer,
+    recipes_limit,
 )
 
 User = get_user_model()
 
 
-class UsersViewSet(UserViewSet):
+class UsersViewSet(ProfilingMixin, ReplicaReadMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = UsersSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('email',)
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
     def get_permissions(self):
@@ -59,10 +78,24 @@ class UsersViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,),
     )
     def subscriptions(self, request):
-        """Авторизованный пользователь получает список своих подписок"""
+        """Авторизованный пользователь получает список своих подписок.
+        Авторы страницы и превью их рецептов загружаются постоянным
+        числом запросов, независимо от числа авторов"""
         user = request.user
-        queryset = User.objects.filter(subscription__user=user)
+        limit = recipes_limit(request)
+        queryset = User.objects.filter(subscription__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()))
         pages = self.paginate_queryset(queryset)
+        prefetch_related_objects(pages, Prefetch(
+            'recipes',
+            queryset=Recipe.objects.latest_per_author(
+                [author.id for author in pages], limit
+            ).only(
+                'id', 'author', 'name', 'image', 'image_variants',
+                'cooking_time',
+            ).order_by('-pub_date', '-id'),
+            to_attr='recipe_previews',
+        ))
         serializer = SubscriptionSerializer(
             pages, many=True, context={'request': request}
         )
@@ -75,41 +108,65 @@ class UsersViewSet(UserViewSet):
     )
     def subscribe(self, request, id):
         """Авторизованный пользователь подписался на автора"""
-        get_object_or_404(User, id=id)
+        author = get_object_or_404(User, id=id)
         serializer = SubscribeSerializer(
-            data={'user': self.request.user.id, 'author': id},
-            context={'request': request},
-        )
+            data={}, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        serializer.save(author=author)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, id):
-        get_object_or_404(User, id=id)
-        user = self.request.user
-        subscription = Subscription.objects.filter(
-            user=user, author=id
-        )
-        if subscription.exists():
-            subscription.delete()
+        """Без проверки exists(): автор ищется, только если подписки
+        не было"""
+        deleted, _ = Subscription.objects.filter(
+            user=request.user, author=id
+        ).delete()
+        if deleted:
             return Response(
                 {'detail': 'Подписка удалена'},
                 status=status.HTTP_204_NO_CONTENT,
             )
+        get_object_or_404(User, id=id)
         return Response(
             {'detail': 'Нельзя удалить несуществующую подписку'},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ProfilingMixin, ReplicaReadMixin, ModelViewSet):
     queryset = Recipe.objects.all()
     pagination_class = CustomPagination
+    cursor_orderings = {
+        None: ('-pub_date', '-id'),
+        'popular': ('-favorites_count', '-pub_date', '-id'),
+        'trending': ('-trending', '-pub_date', '-id'),
+        'search': ('-search_rank', '-pub_date', '-id'),
+    }
     permission_classes = (IsAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        user = self.request.user
+        return (
+            super().get_queryset()
+            .with_related()
+            .with_user_flags(user)
+        )
+
+    @property
+    def cursor_ordering(self):
+        """Курсор в том же порядке, что и выдача RecipeFilter"""
+        if self.action in ('match', 'feed'):
+            return None
+        params = self.request.query_params
+        ordering = params.get('ordering')
+        if ordering is None and params.get('search'):
+            ordering = 'search'
+        return self.cursor_orderings.get(
+            ordering, self.cursor_orderings[None])
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeSerializer
@@ -118,36 +175,151 @@ class RecipeViewSet(ModelViewSet):
     @action(
         detail=False,
         permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+        content_negotiation_class=ShoppingListNegotiation,
     )
     def download_shopping_cart(self, request):
+        """Список покупок в формате из ?format= (txt, csv, json, pdf)"""
         user = request.user
-
-        if not user.shopping_cart.exists():
+        # нулевые строки не удаляются, поэтому дата изменения
+        # сдвигается при любом изменении корзины
+        state = user.shopping_list.aggregate(
+            items=Count('id', filter=Q(amount__gt=0)),
+            total=Sum('amount'),
+            updated=Max('updated'),
+        )
+        if not state['items']:
             return Response(status=status.HTTP_400_BAD_REQUEST)
+        last_modified = state['updated'].timestamp()
+
+        renderer = request.accepted_renderer
+        etag = quote_etag(
+            md5(
+                f'{renderer.format}:{last_modified}:'
+                f'{state["items"]}:{state["total"]}'.encode()
+            ).hexdigest()
+        )
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified)
+        )
+        if not_modified is not None:
+            return not_modified
 
         ingredients = (
-            IngredientRecipe.objects.filter(
-                recipe__shopping_cart__user=request.user
+            user.shopping_list.filter(amount__gt=0)
+            .values(
+                'amount',
+                name=F('ingredient__name'),
+                measurement_unit=F('ingredient__measurement_unit'),
             )
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(amount=Sum('amount'))
+            .order_by('name', 'measurement_unit')
         )
 
-        shopping_list = 'Список покупок\n'
-        shopping_list += '\n'.join(
-            [
-                f'- {ingredient["ingredient__name"]} '
-                f'({ingredient["ingredient__measurement_unit"]})'
-                f' - {ingredient["amount"]}'
-                for ingredient in ingredients
-            ]
+        filename = f'{constants.FILENAME}.{renderer.format}'
+        # под ASGI Django 3.2 перебирает потоковый ответ в цикле событий,
+        # где ORM недоступен, поэтому файл собирается здесь, в потоке
+        response_class = (
+            HttpResponse if isinstance(request._request, ASGIRequest)
+            else StreamingHttpResponse
+        )
+        response = response_class(
+            renderer.stream(ingredients.iterator()),
+            content_type=renderer.content_type,
         )
-
-        filename = constants.FILENAME
-        response = HttpResponse(shopping_list, content_type='text/plain')
         response['Content-Disposition'] = f'attachment; filename={filename}'
+        response['Last-Modified'] = http_date(last_modified)
+        response['ETag'] = etag
         return response
 
+    @action(detail=False)
+    def match(self, request):
+        """Рецепты из имеющихся ингредиентов ?ingredients=1,2,3: сначала
+        те, для которых всего хватает, затем с наименьшим числом
+        недостающих (не больше ?max_missing=)"""
+        params = request.query_params
+        try:
+            ingredient_ids = {
+                int(value)
+                for param in params.getlist('ingredients')
+                for value in param.split(',') if value
+            }
+            max_missing = params.get('max_missing')
+            max_missing = int(max_missing) if max_missing else None
+        except ValueError:
+            return Response(
+                {'detail': 'ingredients и max_missing — целые числа'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not ingredient_ids:
+            return Response(
+                {'ingredients': 'Укажите хотя бы один ингредиент'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        matches = match_index.lookup(ingredient_ids, max_missing)
+        if matches is None:
+            matches = Recipe.objects.matching(
+                ingredient_ids, max_missing
+            ).values_list('id', 'missing')
+        missing = dict(self.paginate_queryset(matches))
+        recipes = self.get_queryset().in_bulk(missing)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in missing if pk in recipes], many=True)
+        data = serializer.data
+        for item in data:
+            item['missing_ingredients'] = missing[item['id']]
+        return self.get_paginated_response(data)
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые первыми. Страницы по
+        ?cursor= из ссылки next, размер — ?limit="""
+        size = self.paginator.get_page_size(request)
+        try:
+            cursor = request.query_params.get('cursor')
+            items = feed.page(
+                request.user, size,
+                feed.decode_cursor(cursor) if cursor else None,
+            )
+        except ValueError:
+            return Response(
+                {'detail': 'Неверный курсор'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for _, recipe_id in items])
+        serializer = self.get_serializer(
+            [recipes[pk] for _, pk in items if pk in recipes], many=True)
+        next_url = None
+        if len(items) == size:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor',
+                feed.encode_cursor(items[-1]),
+            )
+        return Response({'next': next_url, 'results': serializer.data})
+
+    @action(
+        detail=True,
+        url_path=r'image/(?P<width>\d+)\.(?P<extension>webp|jpeg)',
+    )
+    def image(self, request, pk, width, extension):
+        """Редирект на вариант фото ближайшей ширины; варианты фото,
+        загруженного до их появления, собираются при первом запросе"""
+        recipe = get_object_or_404(
+            Recipe.objects.only('image', 'image_variants'), pk=pk)
+        variants = recipe.image_variants
+        if not variants:
+            # фото ещё обрабатывается, не загрузилось или файл удалён
+            if not recipe.image or not default_storage.exists(
+                recipe.image.name
+            ):
+                raise Http404
+            variants = images.build_from_storage(recipe.image.name)
+            Recipe.objects.filter(pk=pk).update(image_variants=variants)
+        widths = sorted(map(int, variants[extension]))
+        width = next((w for w in widths if w >= int(width)), widths[-1])
+        return redirect(default_storage.url(variants[extension][str(width)]))
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -170,11 +342,60 @@ class RecipeViewSet(ModelViewSet):
             return self.adding(ShoppingCartSerializer, request, pk)
         return self.deleting(ShoppingCart, request, pk)
 
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='favorite',
+        permission_classes=(IsAuthenticated,),
+    )
+    def favorite_batch(self, request):
+        """Пакет рецептов {"recipes": [id, …]} в избранное или из него"""
+        return self.batching(
+            request, batch.add_favorites, batch.remove_favorites)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='shopping_cart',
+        permission_classes=(IsAuthenticated,),
+    )
+    def shopping_cart_batch(self, request):
+        """Пакет рецептов {"recipes": [id, …]} в корзину или из неё"""
+        return self.batching(
+            request, batch.add_to_cart, batch.remove_from_cart)
+
+    @staticmethod
+    def batching(request, add, remove):
+        """Результат по каждому рецепту: added/exists при добавлении,
+        removed/absent при удалении, not_found — рецепта нет"""
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        found = set(
+            Recipe.objects.filter(id__in=recipe_ids)
+            .values_list('id', flat=True)
+        )
+        if request.method == 'POST':
+            change, done, skipped = add, 'added', 'exists'
+        else:
+            change, done, skipped = remove, 'removed', 'absent'
+        changed = set(change(
+            request.user.id, [pk for pk in recipe_ids if pk in found]))
+        return Response({'results': [
+            {
+                'id': pk,
+                'status': (
+                    done if pk in changed
+                    else skipped if pk in found else 'not_found'
+                ),
+            }
+            for pk in recipe_ids
+        ]})
+
     @staticmethod
     def adding(serializ, request, pk):
-        user = request.user
         serializer = serializ(
-            data={'recipe': pk, 'user': user.id},
+            data={'recipe': pk},
             context={'request': request},
         )
         serializer.is_valid(raise_exception=True)
@@ -183,30 +404,79 @@ class RecipeViewSet(ModelViewSet):
 
     @staticmethod
     def deleting(model, request, pk):
-        get_object_or_404(Recipe, id=pk)
-        favorite = model.objects.filter(recipe=pk, user=request.user.id)
-        if not favorite.exists():
+        """Без проверки exists(): рецепт ищется, только если удалять
+        было нечего"""
+        deleted, _ = model.objects.filter(
+            recipe=pk, user=request.user
+        ).delete()
+        if deleted:
             return Response(
-                {'detail': 'Такого рецепта нет'},
-                status=status.HTTP_400_BAD_REQUEST,
+                {'detail': 'Рецепт успешно удален'},
+                status=status.HTTP_204_NO_CONTENT,
             )
-        favorite.delete()
+        get_object_or_404(Recipe, id=pk)
         return Response(
-            {'detail': 'Рецепт успешно удален'},
-            status=status.HTTP_204_NO_CONTENT,
+            {'detail': 'Такого рецепта нет'},
+            status=status.HTTP_400_BAD_REQUEST,
         )
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(
+    ReplicaReadMixin, ResponseCacheMixin, ReadOnlyModelViewSet
+):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    cache_version = 'tags'
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(
+    ReplicaReadMixin, ResponseCacheMixin, ReadOnlyModelViewSet
+):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     filter_backends = (DjangoFilterBackend, filters.SearchFilter)
     filterset_class = IngredientFilter
     search_fields = ('name',)
+    cache_version = 'ingredients'
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, self.autocomplete, *args, **kwargs)
+
+    def autocomplete(self, request, *args, **kwargs):
+        """Автодополнение: ответ из процессного индекса, если он готов"""
+        results = ingredient_index.lookup(request.query_params)
+        if results is not None:
+            return Response(results)
+        queryset = self.filter_queryset(self.get_queryset())
+        limit = ingredient_index.parse_limit(request.query_params.get('limit'))
+        serializer = self.get_serializer(queryset[:limit], many=True)
+        return Response(serializer.data)
+
+
+class ProfilingView(APIView):
+    """Маршруты с наибольшим временем в базе, запросами или повторами.
+
+    Статистика процесса, обработавшего запрос (core.profiling);
+    DELETE очищает её.
+    """
+
+    permission_classes = (IsAdminUser,)
+    orders = ('sql_ms', 'queries', 'duplicates', 'p95_ms', 'max_ms')
+
+    def get(self, request):
+        order = request.query_params.get('order', 'sql_ms')
+        if order not in self.orders:
+            return Response(
+                {'order': f'Допустимые значения: {", ".join(self.orders)}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = request.query_params.get('limit', '')
+        limit = int(limit) if limit.isdigit() else 10
+        return Response(profiling.registry.top(order, limit))
+
+    def delete(self, request):
+        profiling.registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -1,7 +1,32 @@
+"""ASGI-приложение для запуска с воркерами uvicorn (SERVER_MODE=asgi).
+
+В Django 3.2 нет асинхронного ORM, и представления DRF синхронные:
+Django выполняет их через sync_to_async. Без ThreadSensitiveContext
+весь синхронный код процесса идёт в одном общем потоке, то есть
+запросы обрабатываются по одному. Здесь у каждого запроса свой
+поток, а число одновременно обрабатываемых запросов ограничено
+ASGI_THREADS: остальные ждут в цикле событий, не занимая потоков.
+Медленные клиенты обслуживает цикл событий uvicorn.
+"""
+import asyncio
 import os
 
+from asgiref.sync import ThreadSensitiveContext
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+threads = int(os.getenv('ASGI_THREADS', 8))
+slots = None
+
+
+async def application(scope, receive, send):
+    global slots
+    if scope['type'] != 'http':
+        return await django_application(scope, receive, send)
+    if slots is None:
+        # в Python 3.9 семафор привязывается к циклу событий при создании
+        slots = asyncio.Semaphore(threads)
+    async with slots, ThreadSensitiveContext():
+        await django_application(scope, receive, send)
@@ -49,6 +49,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Server-Timing и статистика SQL по маршрутам (core.profiling)
+if os.getenv('REQUEST_PROFILING', 'True') == 'True':
+    MIDDLEWARE.insert(0, 'core.profiling.QueryProfilingMiddleware')
+REQUEST_PROFILING_WINDOW = int(os.getenv('REQUEST_PROFILING_WINDOW', 500))
+
 ROOT_URLCONF = 'backend.urls'
 AUTH_USER_MODEL = 'users.User'
 
@@ -73,7 +78,7 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.AllowAny',),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -85,6 +90,10 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6,
 }
 
+# Сколько секунд токен и пользователь хранятся в кеше
+# (users.authentication)
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+
 DJOSER = {
     'SERIALIZERS': {
         'user': 'api.serializers.UsersSerializer',
@@ -108,12 +117,56 @@ if os.getenv('USE_SQLITE', 'True') == 'True':
 else:
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            # django.db.backends.postgresql с CONN_HEALTH_CHECKS
+            'ENGINE': 'core.backends.postgresql',
             'NAME': os.getenv('POSTGRES_DB', 'django'),
             'USER': os.getenv('POSTGRES_USER', 'django'),
             'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
             'HOST': os.getenv('DB_HOST', ''),
-            'PORT': os.getenv('DB_PORT', 5432)
+            'PORT': os.getenv('DB_PORT', 5432),
+            # под ASGI у каждого запроса свой поток, и постоянное
+            # соединение не переиспользуется, а остаётся открытым
+            'CONN_MAX_AGE': (
+                0 if os.getenv('SERVER_MODE') == 'asgi'
+                else int(os.getenv('CONN_MAX_AGE', 60))
+            ),
+            # проверяет core.db.HealthCheckMixin
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+
+# Реплики для чтения (core.db): через запятую хосты PostgreSQL
+# (host или host:port) или пути к файлам SQLite
+for number, replica in enumerate(
+    filter(None, map(str.strip, os.getenv('DB_REPLICAS', '').split(','))),
+    start=1,
+):
+    replica_settings = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if replica_settings['ENGINE'].endswith('sqlite3'):
+        replica_settings['NAME'] = replica
+    else:
+        host, _, port = replica.partition(':')
+        replica_settings.update(
+            HOST=host, PORT=port or replica_settings['PORT'])
+    DATABASES[f'replica{number}'] = replica_settings
+DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+# сколько секунд после изменения пользователь читает с основной базы
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+# Кеш ответов справочников и версий данных (core.versions).
+# У локального кеша своя копия в каждом процессе; при нескольких
+# воркерах нужен CACHE_DIR, без него gunicorn.conf.py не запустится.
+if os.getenv('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         }
     }
 
@@ -158,6 +211,34 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# TTF-шрифт с кириллицей для выгрузки списка покупок в PDF
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+# Окно сортировки ?ordering=trending в днях (recipes.trending)
+TRENDING_DAYS = int(os.getenv('TRENDING_DAYS', 7))
+
+# Рецепты авторов с большим числом подписчиков не раскладываются по
+# лентам, а читаются при запросе ленты (recipes.feed)
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+
+# Больше пикселей в загружаемом фото рецепта нельзя
+IMAGE_UPLOAD_MAX_PIXELS = int(
+    os.getenv('IMAGE_UPLOAD_MAX_PIXELS', 40_000_000))
+
+# Больше байт в загружаемом фото нельзя, проверяется по длине base64
+IMAGE_UPLOAD_MAX_BYTES = int(
+    os.getenv('IMAGE_UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+
+# Фото декодируется, проверяется и уменьшается вне запроса
+# (api.uploads): потоков и ожидающих фото на процесс. False — всё в
+# запросе, так фото проверяются в тестах
+IMAGE_UPLOAD_ASYNC = os.getenv('IMAGE_UPLOAD_ASYNC', 'True') == 'True'
+IMAGE_UPLOAD_WORKERS = int(os.getenv('IMAGE_UPLOAD_WORKERS', 2))
+IMAGE_UPLOAD_QUEUE = int(os.getenv('IMAGE_UPLOAD_QUEUE', 8))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
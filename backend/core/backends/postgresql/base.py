@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from core.db import HealthCheckMixin
+
+
+class DatabaseWrapper(HealthCheckMixin, base.DatabaseWrapper):
+    pass
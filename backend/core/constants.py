@@ -10,4 +10,6 @@ MES_UNIT_NAME_MAX_LENGHT = 200
 TAG_NAME_MAX_LENGHT = 200
 TAG_COLOR_MAX_LENGHT = 7
 TAG_SLUG_MAX_LENGHT = 200
-FILENAME = 'my_shopping_list.txt'
+FILENAME = 'my_shopping_list'
+SHOPPING_LIST_TITLE = 'Список покупок'
+BATCH_MAX_RECIPES = 100
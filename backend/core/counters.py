@@ -0,0 +1,49 @@
+"""Денормализованные счётчики, обновляемые из сигналов.
+
+Изменение — один UPDATE с F(), без чтения строки, поэтому
+параллельные запросы не теряют инкременты. Обычный save() модели с
+CounterFieldsMixin счётчики не пишет, иначе он вернул бы значение,
+прочитанное до чужого инкремента. Расхождения (bulk_create, правки в
+обход ORM) исправляет команда reconcile_counters.
+"""
+from django.db.models import F
+
+
+class CounterFieldsMixin:
+    """save() существующей строки без update_fields обновляет все поля,
+    кроме counter_fields и отложенных (defer/only)"""
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not args
+            and not self._state.adding
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            skipped = set(self.counter_fields) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+
+def increment(model, pk, field):
+    model.objects.filter(pk=pk).update(**{field: F(field) + 1})
+
+
+def decrement(model, pk, field):
+    # ниже нуля не опускаем, поле положительное
+    model.objects.filter(pk=pk, **{f'{field}__gt': 0}).update(
+        **{field: F(field) - 1})
+
+
+def increment_all(model, pks, field):
+    model.objects.filter(pk__in=pks).update(**{field: F(field) + 1})
+
+
+def decrement_all(model, pks, field):
+    model.objects.filter(pk__in=pks, **{f'{field}__gt': 0}).update(
+        **{field: F(field) - 1})
@@ -0,0 +1,91 @@
+"""Чтение с реплик и проверка постоянных соединений.
+
+Реплики — алиасы replica1, replica2… из DB_REPLICAS (settings).
+ReplicaRouter отправляет чтения на реплику из контекстной переменной
+replica, всё остальное — на default. Вьюсеты с
+api.mixins.ReplicaReadMixin выбирают случайную реплику на весь
+безопасный запрос, чтобы ответ собирался из одного снимка данных, и
+делают это после аутентификации, поэтому токен всегда проверяется по
+основной базе.
+
+Чтение своих записей: после изменяющего запроса пользователь на
+REPLICA_PIN_SECONDS закрепляется за основной базой — реплика могла
+ещё не получить его изменения. Метка хранится в кеше Django, общем
+для процессов, если задан CACHE_DIR.
+
+В Django 3.2 нет CONN_HEALTH_CHECKS, его повторяет HealthCheckMixin
+бэкенда core.backends.postgresql так же, как Django 4.1: постоянное
+соединение проверяется не в начале каждого запроса, а при первом
+курсоре в нём, и запросы, не дошедшие до базы, обходятся без SELECT 1.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_KEY = 'replica-pin:{}'
+
+replica = ContextVar('replica', default=None)
+
+
+def choose_replica():
+    aliases = [
+        alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+    return random.choice(aliases) if aliases else None
+
+
+def pin(user):
+    cache.set(PIN_KEY.format(user.pk), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(PIN_KEY.format(user.pk), False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики — копии default, связи между ними допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class HealthCheckMixin:
+    """CONN_HEALTH_CHECKS из Django 4.1 для DatabaseWrapper"""
+
+    health_check_done = False
+
+    def connect(self):
+        super().connect()
+        # новое соединение проверять незачем
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # вызывается сигналами начала и конца запроса
+        if self.connection is not None:
+            self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def close_if_health_check_failed(self):
+        if (
+            self.connection is None
+            or self.health_check_done
+            or not self.settings_dict.get('CONN_HEALTH_CHECKS')
+        ):
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
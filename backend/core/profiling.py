@@ -0,0 +1,170 @@
+"""Учёт времени и SQL-запросов по эндпоинтам.
+
+RequestProfile подключается к соединениям через execute_wrapper и
+считает запросы, время в базе и повторы одного и того же SQL
+(признак N+1: Django подставляет параметры отдельно, поэтому текст
+запроса в цикле совпадает). Итог запроса уходит в заголовок
+Server-Timing и в скользящее окно последних запросов маршрута.
+
+Статистика своя у каждого процесса. Запросы, выполненные при чтении
+потокового ответа, уже после выхода из middleware, не учитываются.
+"""
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+from statistics import median, quantiles
+
+from django.conf import settings
+from django.db import connections
+
+IN_LIST = re.compile(r'\(%s(?:, %s)+\)')
+
+
+def fingerprint(sql):
+    """Схлопывает списки IN разной длины в один отпечаток"""
+    return IN_LIST.sub('(%s, ...)', sql)
+
+
+class RequestProfile:
+    """Счётчики одного запроса, вызывается как execute_wrapper"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.segments = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def add_segment(self, name, seconds):
+        self.segments[name] = self.segments.get(name, 0) + seconds
+
+    @property
+    def duplicates(self):
+        """{отпечаток: число повторов сверх первого}"""
+        counts = Counter()
+        for sql, count in self.statements.items():
+            counts[fingerprint(sql)] += count
+        return {sql: count - 1 for sql, count in counts.items() if count > 1}
+
+    def server_timing(self, wall, duplicates):
+        metrics = [
+            f'total;dur={wall * 1000:.1f}',
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+        ]
+        metrics.extend(
+            f'{name};dur={seconds * 1000:.1f}'
+            for name, seconds in self.segments.items()
+        )
+        repeats = sum(duplicates.values())
+        if repeats:
+            metrics.append(f'dup;desc="{repeats} repeated queries"')
+        return ', '.join(metrics)
+
+
+class RouteStats:
+    """Последние запросы маршрута и самые частые повторы SQL"""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.duplicates = Counter()
+        self.count = 0
+
+    def add(self, wall, profile, duplicates):
+        self.count += 1
+        self.samples.append(
+            (wall, profile.queries, profile.sql_time, sum(duplicates.values()))
+        )
+        self.duplicates.update(duplicates)
+
+    def summary(self):
+        samples = list(self.samples)
+        walls = [sample[0] * 1000 for sample in samples]
+        p95 = (
+            quantiles(walls, n=20, method='inclusive')[18]
+            if len(walls) > 1 else walls[0]
+        )
+        return {
+            'requests': self.count,
+            'window': len(samples),
+            'p50_ms': round(median(walls), 1),
+            'p95_ms': round(p95, 1),
+            'max_ms': round(max(walls), 1),
+            'queries': round(
+                sum(sample[1] for sample in samples) / len(samples), 1),
+            'sql_ms': round(
+                sum(sample[2] for sample in samples) * 1000 / len(samples), 1
+            ),
+            'duplicates': round(
+                sum(sample[3] for sample in samples) / len(samples), 1),
+            'top_duplicates': [
+                {'sql': sql, 'repeats': count}
+                for sql, count in self.duplicates.most_common(3)
+            ],
+        }
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.routes = defaultdict(
+                lambda: RouteStats(settings.REQUEST_PROFILING_WINDOW))
+
+    def add(self, route, wall, profile, duplicates):
+        with self.lock:
+            self.routes[route].add(wall, profile, duplicates)
+
+    def top(self, order='sql_ms', limit=10):
+        with self.lock:
+            summaries = {
+                route: stats.summary()
+                for route, stats in self.routes.items()
+            }
+        ranked = sorted(
+            summaries.items(), key=lambda item: item[1][order], reverse=True)
+        return [
+            {'route': route, **summary} for route, summary in ranked[:limit]
+        ]
+
+
+registry = Registry()
+
+
+def route_name(request):
+    match = request.resolver_match
+    name = match.view_name if match else 'unresolved'
+    return f'{request.method} {name}'
+
+
+class QueryProfilingMiddleware:
+    """Server-Timing и статистика по маршрутам для каждого запроса"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = request.profile = RequestProfile()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+        wall = time.perf_counter() - profile.started
+        duplicates = profile.duplicates
+        response['Server-Timing'] = profile.server_timing(wall, duplicates)
+        registry.add(route_name(request), wall, profile, duplicates)
+        return response
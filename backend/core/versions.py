@@ -0,0 +1,57 @@
+"""Версии справочных данных для процессных кешей.
+
+Версия — случайная метка в кеше Django, меняется при изменении данных.
+Процесс сравнивает её с меткой своей копии и пересобирает копию при
+расхождении. Между процессами метка общая, если общий бэкенд кеша.
+"""
+import threading
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import connection
+
+KEY = 'data-version:{}'
+
+
+def get_version(name):
+    return cache.get_or_set(KEY.format(name), uuid4().hex, timeout=None)
+
+
+def bump_version(name):
+    cache.set(KEY.format(name), uuid4().hex, timeout=None)
+
+
+class IndexHolder:
+    """Процессная копия данных с версией name и её фоновая пересборка.
+
+    build(version) возвращает новую копию. Пока копии нет или она
+    устарела, get() возвращает None, а копия собирается в потоке.
+    """
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build_index = build
+        self.index = None
+        self.lock = threading.Lock()
+        self.building = False
+
+    def get(self):
+        version = get_version(self.name)
+        index = self.index
+        if index is not None and index.version == version:
+            return index
+        with self.lock:
+            if self.building:
+                return None
+            self.building = True
+        threading.Thread(
+            target=self.build, args=(version,), daemon=True
+        ).start()
+        return None
+
+    def build(self, version):
+        try:
+            self.index = self.build_index(version)
+        finally:
+            self.building = False
+            connection.close()
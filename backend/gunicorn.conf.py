@@ -0,0 +1,29 @@
+"""Настройки gunicorn.
+
+SERVER_MODE=wsgi (по умолчанию) — синхронные воркеры и backend.wsgi,
+SERVER_MODE=asgi — воркеры uvicorn и backend.asgi: медленные клиенты
+не занимают воркер, запросы выполняются в ASGI_THREADS потоках.
+
+Без CACHE_DIR кеш Django локальный для процесса (backend.settings),
+а в нём версии данных, кеш ответов и токенов: при нескольких воркерах
+каждый отдавал бы свои устаревшие копии, поэтому такой запуск
+прерывается.
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:7000')
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'backend.asgi:application'
+else:
+    wsgi_app = 'backend.wsgi:application'
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and not os.getenv('CACHE_DIR'):
+        raise RuntimeError(
+            f'{server.cfg.workers} workers need a shared cache: '
+            'set CACHE_DIR or GUNICORN_WORKERS=1'
+        )
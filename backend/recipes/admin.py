@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.admin import ModelAdmin, display
+from django.db import transaction
 
+from . import images, shopping_list
 from .models import (
     Favorite,
     Ingredient,
@@ -28,9 +30,25 @@ class RecipeAdmin(ModelAdmin):
     list_filter = ('tags', 'name', 'author')
     inlines = (IngredientRecipetInline,)
 
-    @display(description='Добавили в избранное')
+    def save_model(self, request, obj, form, change):
+        if change and 'image' in form.changed_data:
+            # варианты нового фото соберутся при первом запросе srcset
+            old_variants = obj.image_variants
+            obj.image_variants = {}
+            obj.image_status = Recipe.IMAGE_READY
+            transaction.on_commit(
+                lambda: images.delete_variants(old_variants))
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        old_amounts = shopping_list.recipe_amounts(form.instance.id)
+        super().save_related(request, form, formsets, change)
+        if change:
+            shopping_list.update_recipe(form.instance.id, old_amounts)
+
+    @display(description='Добавили в избранное', ordering='favorites_count')
     def add_in_favorites(self, obj):
-        return Favorite.objects.filter(recipe=obj.id).count()
+        return obj.favorites_count
 
 
 @admin.register(Ingredient)
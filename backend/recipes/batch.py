@@ -0,0 +1,106 @@
+"""Пакетное добавление и удаление рецептов в избранном и корзине.
+
+Пакет — постоянное число запросов: bulk_create и один DELETE … IN.
+Ни то, ни другое не отправляет сигналы, поэтому счётчики, рейтинг
+«в тренде» и список покупок обновляются здесь явно, одним запросом на
+весь пакет, а не построчно, как в recipes.signals.
+
+Приращения применяются только к строкам, которые пакет действительно
+вставил или удалил. Пакеты одного пользователя идут по очереди —
+строка пользователя блокируется select_for_update. Одиночные запросы
+не блокируются: вставка идёт без ignore_conflicts, целиком или никак,
+и строку, вставленную ими в промежутке, выдаст IntegrityError, после
+чего пакет пересчитается; удаляемые строки блокируются при выборке.
+"""
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+
+from core import counters
+
+from . import shopping_list, trending
+from .models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+# попыток вставки, если одиночные запросы опережают пакет
+INSERT_ATTEMPTS = 3
+
+
+def lock_user(user_id):
+    list(
+        User.objects.select_for_update().filter(pk=user_id).order_by()
+        .values_list('pk', flat=True)
+    )
+
+
+def present(model, user_id, recipe_ids, lock=False):
+    """id рецептов из recipe_ids, уже добавленных пользователем"""
+    queryset = model.objects.filter(
+        user_id=user_id, recipe_id__in=recipe_ids)
+    if lock:
+        queryset = queryset.select_for_update()
+    return set(queryset.values_list('recipe_id', flat=True))
+
+
+def insert(model, user_id, recipe_ids):
+    """Добавит недостающие рецепты, вернёт id вставленных"""
+    lock_user(user_id)
+    for attempt in range(1, INSERT_ATTEMPTS + 1):
+        existing = present(model, user_id, recipe_ids)
+        added = [pk for pk in recipe_ids if pk not in existing]
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    model(user_id=user_id, recipe_id=pk) for pk in added)
+        except IntegrityError:
+            if attempt == INSERT_ATTEMPTS:
+                raise
+            continue
+        return added
+
+
+def delete(model, user_id, recipe_ids):
+    """Удалит имеющиеся рецепты одним запросом, вернёт их id"""
+    lock_user(user_id)
+    existing = present(model, user_id, recipe_ids, lock=True)
+    removed = [pk for pk in recipe_ids if pk in existing]
+    # _raw_delete — закрытый API QuerySet (Django 3.2, см. requirements.txt):
+    # DELETE без выборки строк и сигналов pre/post_delete, их работу
+    # делают вызывающие функции. Обычный delete() собрал бы строки и
+    # отправил сигналы по каждой. При обновлении Django проверить, что
+    # метод есть и сигнатура _raw_delete(using) не изменилась
+    queryset = model.objects.filter(user_id=user_id, recipe_id__in=removed)
+    queryset._raw_delete(queryset.db)
+    return removed
+
+
+@transaction.atomic
+def add_favorites(user_id, recipe_ids):
+    added = insert(Favorite, user_id, recipe_ids)
+    counters.increment_all(Recipe, added, 'favorites_count')
+    trending.record_all(added)
+    return added
+
+
+@transaction.atomic
+def remove_favorites(user_id, recipe_ids):
+    removed = delete(Favorite, user_id, recipe_ids)
+    counters.decrement_all(Recipe, removed, 'favorites_count')
+    return removed
+
+
+@transaction.atomic
+def add_to_cart(user_id, recipe_ids):
+    added = insert(ShoppingCart, user_id, recipe_ids)
+    if added:
+        shopping_list.add_recipes(user_id, added)
+    trending.record_all(added)
+    return added
+
+
+@transaction.atomic
+def remove_from_cart(user_id, recipe_ids):
+    removed = delete(ShoppingCart, user_id, recipe_ids)
+    if removed:
+        shopping_list.remove_recipes(user_id, removed)
+    return removed
@@ -0,0 +1,168 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+
+Fan-out on write: новый рецепт сразу записывается в ленту (FeedEntry)
+каждого подписчика автора, подписка добавляет в ленту рецепты автора,
+отписка их удаляет. Страница ленты — диапазон индекса
+(user, -pub_date, -recipe), её стоимость не зависит от числа подписок.
+
+У авторов больше FEED_FANOUT_LIMIT подписчиков рецепты по лентам не
+раскладываются (fan-out on read): при чтении их последние рецепты
+берутся по индексу (author, -pub_date) отдельно для каждого автора и
+сливаются с лентой по дате. Записи, оставшиеся в лентах с тех пор,
+когда автор был ниже порога, при слиянии пропускаются как повторы.
+Рецепты, опубликованные автором выше порога, в ленты не попадают и
+после того, как подписчиков станет меньше; их добавит rebuild_feeds.
+"""
+import heapq
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+
+from users.models import Subscription
+
+from .models import FeedEntry, Recipe
+
+User = get_user_model()
+
+
+def is_fanned_out(author_id):
+    """Раскладываются ли рецепты автора по лентам подписчиков"""
+    return User.objects.filter(
+        pk=author_id,
+        subscribers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).exists()
+
+
+def publish(recipe):
+    """Рецепт в ленты подписчиков автора"""
+    if not is_fanned_out(recipe.author_id):
+        return
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe.id,
+                author_id=recipe.author_id,
+                pub_date=recipe.pub_date,
+            )
+            for user_id in Subscription.objects.filter(
+                author_id=recipe.author_id
+            ).values_list('user_id', flat=True).iterator()
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def follow(user_id, author_id):
+    """Рецепты автора в ленту нового подписчика"""
+    if not is_fanned_out(author_id):
+        return
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for recipe_id, pub_date in Recipe.objects.filter(
+                author_id=author_id
+            ).values_list('id', 'pub_date').iterator()
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def unfollow(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def before(queryset, cursor, id_field):
+    """Строки строго после курсора (pub_date, id) в порядке ленты"""
+    if cursor is None:
+        return queryset
+    pub_date, recipe_id = cursor
+    return queryset.filter(
+        Q(pub_date__lt=pub_date)
+        | Q(pub_date=pub_date, **{f'{id_field}__lt': recipe_id})
+    )
+
+
+def page(user, size, cursor=None):
+    """[(pub_date, recipe_id), …] следующей страницы ленты, новые
+    первыми; cursor — последняя пара предыдущей страницы"""
+    streams = [
+        before(FeedEntry.objects.filter(user=user), cursor, 'recipe_id')
+        .order_by('-pub_date', '-recipe_id')
+        .values_list('pub_date', 'recipe_id')[:size]
+    ]
+    # авторы, чьи рецепты читаются при запросе
+    for author_id in Subscription.objects.filter(
+        user=user, author__subscribers_count__gt=settings.FEED_FANOUT_LIMIT
+    ).values_list('author_id', flat=True):
+        streams.append(
+            before(Recipe.objects.filter(author_id=author_id), cursor, 'id')
+            .order_by('-pub_date', '-id')
+            .values_list('pub_date', 'id')[:size]
+        )
+    if len(streams) == 1:
+        return list(streams[0])
+    found = []
+    seen = set()
+    for item in heapq.merge(*streams, reverse=True):
+        if item[1] in seen:
+            continue
+        seen.add(item[1])
+        found.append(item)
+        if len(found) == size:
+            break
+    return found
+
+
+def encode_cursor(item):
+    pub_date, recipe_id = item
+    return urlsafe_b64encode(
+        f'{pub_date.isoformat()}|{recipe_id}'.encode()).decode()
+
+
+def decode_cursor(value):
+    """Пара (pub_date, recipe_id) из ?cursor=, ValueError при ошибке"""
+    try:
+        pub_date, recipe_id = urlsafe_b64decode(
+            value.encode()).decode().split('|')
+        return datetime.fromisoformat(pub_date), int(recipe_id)
+    except (TypeError, UnicodeError, ValueError) as error:
+        raise ValueError('Неверный курсор') from error
+
+
+@transaction.atomic
+def rebuild(batch_size=1000):
+    """Заново заполняет ленты из подписок, вернёт число записей"""
+    FeedEntry.objects.all().delete()
+    rows = Subscription.objects.filter(
+        author__subscribers_count__lte=settings.FEED_FANOUT_LIMIT
+    ).values_list(
+        'user_id', 'author__recipes__id', 'author_id',
+        'author__recipes__pub_date',
+    ).order_by().iterator()
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id, recipe_id, author_id, pub_date in rows
+            # авторы без рецептов
+            if recipe_id is not None
+        ),
+        batch_size=batch_size,
+    )
+    return FeedEntry.objects.count()
@@ -0,0 +1,122 @@
+"""Уменьшенные копии фото рецептов.
+
+Картинка открывается Pillow один раз: поворот по EXIF применяется к
+пикселям, метаданные (EXIF, GPS, ICC) отбрасываются. Из неё пишутся
+очищенный оригинал и варианты шириной VARIANT_WIDTHS в WebP и JPEG.
+Увеличения нет: варианты шире оригинала не создаются, самый узкий
+создаётся всегда.
+
+Список вариантов хранится в Recipe.image_variants:
+{'webp': {'320': 'recipes/images/variants/…-320.webp', …}, 'jpeg': {…}}.
+"""
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+VARIANT_WIDTHS = (320, 640, 1280)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'recipes/images/variants'
+
+
+def open_image(file, max_pixels=None):
+    image = Image.open(file)
+    # размер известен по заголовку, пиксели ещё не декодированы
+    if max_pixels and image.width * image.height > max_pixels:
+        raise ValueError(f'Изображение больше {max_pixels} пикселей')
+    image_format = image.format
+    image = ImageOps.exif_transpose(image)
+    image.load()
+    # exif_transpose возвращает копию, у которой формат не сохраняется
+    image.format = image_format
+    return image
+
+
+def encode(image, image_format, **options):
+    if image_format in ('JPEG', 'WEBP') and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    # info не передаётся в save(), поэтому метаданные не записываются
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def clean_original(image, name):
+    """Оригинал в исходном формате, но без метаданных"""
+    image_format = image.format or 'PNG'
+    options = {'quality': 90} if image_format in ('JPEG', 'WEBP') else {}
+    return ContentFile(encode(image, image_format, **options), name=name)
+
+
+def variant_name(name, width, extension):
+    return f'{VARIANTS_DIR}/{PurePosixPath(name).stem}-{width}.{extension}'
+
+
+def build_variants(image, name):
+    """Пишет варианты картинки в хранилище, вернёт их список"""
+    widths = [width for width in VARIANT_WIDTHS if width <= image.width]
+    widths = widths or [image.width]
+    manifest = {}
+    for extension, (image_format, options) in FORMATS.items():
+        manifest[extension] = {}
+        for width in widths:
+            variant = image.copy()
+            variant.thumbnail(
+                (width, variant.height), Image.Resampling.LANCZOS)
+            path = variant_name(name, width, extension)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            manifest[extension][str(width)] = default_storage.save(
+                path,
+                ContentFile(encode(variant, image_format, **options)),
+            )
+    return manifest
+
+
+def build_from_storage(name):
+    """Варианты для уже сохранённой картинки (досборка старых фото)"""
+    with default_storage.open(name) as file:
+        return build_variants(open_image(file), name)
+
+
+def delete_variants(manifest):
+    """Удаляет файлы вариантов, если на них не ссылается другой рецепт:
+    рецепты из generate_data делят одно фото и его варианты"""
+    paths = {
+        path for variants in manifest.values() for path in variants.values()}
+    if not paths:
+        return
+    query = Q()
+    for path in paths:
+        query |= Q(variants_text__contains=f'"{path}"')
+    used = {
+        path
+        for other in Recipe.objects.annotate(
+            variants_text=Cast('image_variants', TextField())
+        ).filter(query).values_list('image_variants', flat=True)
+        for variants in other.values()
+        for path in variants.values()
+    }
+    for path in paths - used:
+        default_storage.delete(path)
+
+
+def srcset(manifest):
+    """{'webp': 'url 320w, url 640w', 'jpeg': …} для атрибута srcset"""
+    return {
+        extension: ', '.join(
+            f'{default_storage.url(path)} {width}w'
+            for width, path in sorted(
+                variants.items(), key=lambda item: int(item[0]))
+        )
+        for extension, variants in manifest.items()
+    }
@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from recipes import images
+from recipes.models import Recipe
+
+
+def build(recipe_id, name):
+    """Выполняется в процессе пула, к базе не обращается"""
+    try:
+        return recipe_id, images.build_from_storage(name), None
+    except Exception as error:
+        return recipe_id, None, f'{type(error).__name__}: {error}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Build resized WebP/JPEG variants for recipe photos that have '
+        'none yet, in a pool of worker processes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int, default=os.cpu_count(), help='Worker processes',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rebuild the variants of every photo',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int, default=100, help='Recipes per UPDATE',
+        )
+
+    def handle(self, *args, **kwargs):
+        recipes = Recipe.objects.exclude(image='')
+        if not kwargs['force']:
+            recipes = recipes.filter(image_variants={})
+        jobs = list(recipes.values_list('id', 'image'))
+        if not jobs:
+            self.stdout.write(self.style.SUCCESS('Nothing to build'))
+            return
+        batch_size = kwargs['batch_size']
+
+        built = failed = 0
+        pending = []
+        with ProcessPoolExecutor(
+            max_workers=kwargs['workers'], initializer=django.setup
+        ) as pool:
+            for recipe_id, variants, error in pool.map(
+                build, *zip(*jobs), chunksize=8
+            ):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'recipe={recipe_id}: {error}')
+                    continue
+                pending.append(Recipe(id=recipe_id, image_variants=variants))
+                if len(pending) >= batch_size:
+                    built += self.save(pending)
+        built += self.save(pending)
+        self.stdout.write(self.style.SUCCESS(
+            f'Built variants for {built} recipes, {failed} failed'))
+
+    @staticmethod
+    def save(recipes):
+        Recipe.objects.bulk_update(recipes, ('image_variants',))
+        saved = len(recipes)
+        recipes.clear()
+        return saved
@@ -0,0 +1,249 @@
+import random
+from datetime import timedelta
+from itertools import accumulate, islice
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Max, Value, When
+from django.utils import timezone
+from PIL import Image
+
+from core.versions import bump_version
+from recipes import images
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+)
+from users.models import Subscription
+
+User = get_user_model()
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F2C12E', 'dessert'),
+    ('Выпечка', '#2D9CDB', 'bakery'),
+    ('Напитки', '#EB5757', 'drinks'),
+)
+PASSWORD = 'generated-password'
+# общее фото сгенерированных рецептов
+PLACEHOLDER_IMAGE = 'recipes/images/generated.png'
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a reproducible synthetic dataset: users, recipes with '
+        'tags and ingredients, subscriptions, favorites and carts. '
+        f'All users get the password {PASSWORD!r}.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument(
+            '--seed', type=int, default=0, help='Random seed')
+        parser.add_argument(
+            '--prefix', default='generated',
+            help='Username/e-mail prefix of the generated users')
+        parser.add_argument(
+            '--ingredients-file',
+            default=str(Path(settings.BASE_DIR, 'data', 'ingredients.csv')),
+        )
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2, default=(3, 12),
+            metavar=('MIN', 'MAX'))
+        parser.add_argument(
+            '--tags-per-recipe', type=int, nargs=2, default=(1, 3),
+            metavar=('MIN', 'MAX'))
+        parser.add_argument('--subscriptions-per-user', type=int, default=10)
+        parser.add_argument('--favorites-per-user', type=int, default=30)
+        parser.add_argument('--cart-per-user', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.weights = {}
+        self.batch_size = options['batch_size']
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Users with prefix {prefix!r} already exist, '
+                'use another --prefix')
+
+        call_command(
+            'import_ingredients', options['ingredients_file'], verbosity=0)
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True))
+        tag_ids = [
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )[0].id
+            for name, color, slug in TAGS
+        ]
+
+        with transaction.atomic():
+            user_ids = self.create_users(prefix, options['users'])
+            recipe_ids = self.create_recipes(
+                user_ids, options['recipes'], tag_ids, ingredient_ids,
+                options['tags_per_recipe'], options['ingredients_per_recipe'],
+            )
+            self.create_relations(
+                Subscription, 'author_id', user_ids, user_ids,
+                options['subscriptions_per_user'],
+            )
+            self.create_relations(
+                Favorite, 'recipe_id', user_ids, recipe_ids,
+                options['favorites_per_user'],
+            )
+            self.create_relations(
+                ShoppingCart, 'recipe_id', user_ids, recipe_ids,
+                options['cart_per_user'],
+            )
+        # связи созданы через bulk_create, без сигналов
+        call_command('rebuild_shopping_lists', verbosity=0)
+        call_command('reconcile_counters', verbosity=0)
+        call_command('rebuild_search_index', verbosity=0)
+        call_command('rebuild_feeds', verbosity=0)
+        bump_version('recipe-ingredients')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(user_ids)} users and {len(recipe_ids)} '
+            f'recipes (first user: {prefix}0@example.com)'))
+
+    @staticmethod
+    def placeholder_image():
+        """Файл фото и его варианты, пишутся один раз на все рецепты"""
+        if not default_storage.exists(PLACEHOLDER_IMAGE):
+            image = Image.new('RGB', (1280, 853), '#E26C2D')
+            default_storage.save(
+                PLACEHOLDER_IMAGE, ContentFile(images.encode(image, 'PNG')))
+        return PLACEHOLDER_IMAGE, images.build_from_storage(PLACEHOLDER_IMAGE)
+
+    def popular(self, population, count):
+        """Выборка без повторов, смещённая к началу списка (закон Ципфа)"""
+        count = min(count, len(population))
+        key = (id(population), len(population))
+        if key not in self.weights:
+            self.weights[key] = list(
+                accumulate(1 / rank for rank in range(1, len(population) + 1))
+            )
+        chosen = set()
+        while len(chosen) < count:
+            chosen.update(self.random.choices(
+                population, cum_weights=self.weights[key],
+                k=count - len(chosen),
+            ))
+        return sorted(chosen)
+
+    def bulk_create(self, model, objects):
+        """bulk_create партиями, возвращает id новых строк"""
+        last_id = model.objects.aggregate(last=Max('id'))['last'] or 0
+        for batch in batched(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+        return list(
+            model.objects.filter(id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)
+        )
+
+    def create_users(self, prefix, count):
+        password = make_password(PASSWORD)
+        return self.bulk_create(User, (
+            User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@example.com',
+                first_name=f'Имя{number}',
+                last_name=f'Фамилия{number}',
+                password=password,
+            )
+            for number in range(count)
+        ))
+
+    def create_recipes(self, user_ids, count, tag_ids, ingredient_ids,
+                       tags_per_recipe, ingredients_per_recipe):
+        authors = [self.popular(user_ids, 1)[0] for _ in range(count)]
+        image, image_variants = self.placeholder_image()
+        recipe_ids = self.bulk_create(Recipe, (
+            Recipe(
+                author_id=author_id,
+                name=f'Рецепт {number}',
+                text=f'Описание рецепта {number}',
+                image=image,
+                image_variants=image_variants,
+                cooking_time=self.random.randint(5, 180),
+            )
+            for number, author_id in enumerate(authors)
+        ))
+
+        # auto_now_add ставит всем одно время, разносим даты публикации
+        now = timezone.now()
+        positions = enumerate(reversed(recipe_ids))
+        for batch in batched(positions, self.batch_size):
+            Recipe.objects.filter(
+                id__in=[recipe_id for _, recipe_id in batch]
+            ).update(pub_date=Case(
+                *(
+                    When(
+                        id=recipe_id,
+                        then=Value(now - timedelta(minutes=position * 10)),
+                    )
+                    for position, recipe_id in batch
+                ),
+                output_field=DateTimeField(),
+            ))
+
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in self.random.sample(
+                    tag_ids, self.random.randint(*tags_per_recipe))
+            ),
+            batch_size=self.batch_size,
+        )
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500),
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in self.random.sample(
+                    ingredient_ids,
+                    self.random.randint(*ingredients_per_recipe),
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        return recipe_ids
+
+    def create_relations(self, model, field, user_ids, targets, per_user):
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, **{field: target})
+                for user_id in user_ids
+                for target in self.popular(targets, per_user)
+                # подписка на самого себя запрещена
+                if not (model is Subscription and target == user_id)
+            ),
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
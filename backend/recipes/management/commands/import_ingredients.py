@@ -1,28 +1,151 @@
 import csv
+import gzip
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from core.versions import bump_version
 from recipes.models import Ingredient
 
+FORMATS = ('csv', 'json', 'jsonl')
+CHUNK_SIZE = 64 * 1024
+
 
 class Command(BaseCommand):
-    help = 'Import ingredients from a CSV file'
+    help = (
+        'Import ingredients from a CSV, JSON or JSON Lines file '
+        '(optionally gzipped). A JSON file must hold one array of '
+        'objects; it is parsed element by element, not loaded whole. '
+        'Existing ingredients are skipped, so the command can be re-run '
+        'safely.'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
             'csv_file_path',
-            type=str, help='The CSV file path'
+            type=str, help='The file path (.csv, .json, .jsonl, [.gz])'
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='File format, by default taken from the extension',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int, default=500, help='Rows per INSERT'
         )
 
     def handle(self, *args, **kwargs):
-        file_path = kwargs['csv_file_path']
+        path = Path(kwargs['csv_file_path'])
+        compressed = path.suffix == '.gz'
+        file_format = kwargs['format'] or (
+            path.with_suffix('') if compressed else path
+        ).suffix.lstrip('.')
+        if file_format not in FORMATS:
+            raise CommandError(
+                f'Unknown format {file_format!r}, use --format')
+        batch_size = kwargs['batch_size']
+        self.verbosity = kwargs['verbosity']
+
+        inserted = skipped = 0
+        started = time.monotonic()
+        opener = gzip.open if compressed else open
+        with opener(path, 'rt', newline='', encoding='utf-8') as file:
+            rows = self.read_rows(file, file_format)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                created = self.import_batch(batch)
+                inserted += created
+                skipped += len(batch) - created
+                self.report(inserted + skipped, started, level=2)
 
-        with open(file_path, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                Ingredient.objects.create(
-                    name=row['name'],
-                    measurement_unit=row['measurement_unit'])
+        if inserted:
+            bump_version('ingredients')
+        self.report(inserted + skipped, started, level=1)
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully imported ingredients: inserted {inserted}, '
+            f'skipped {skipped}'))
 
+    @staticmethod
+    def read_rows(file, file_format):
+        if file_format == 'csv':
+            rows = csv.DictReader(file)
+        elif file_format == 'json':
+            rows = iter_array(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for row in rows:
+            yield row['name'], row['measurement_unit']
+
+    @staticmethod
+    @transaction.atomic
+    def import_batch(batch):
+        """Добавляет новые пары (name, measurement_unit), вернёт их число"""
+        keys = set(batch)
+        existing = set(
+            Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list('name', 'measurement_unit')
+        )
+        new = keys - existing
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in new
+            ),
+            ignore_conflicts=True,
+        )
+        return len(new)
+
+    def report(self, processed, started, level):
+        if self.verbosity < level:
+            return
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else processed
         self.stdout.write(
-            self.style.SUCCESS('Successfully imported ingredients'))
+            f'{processed} rows in {elapsed:.1f}s ({rate:.0f} rows/s)')
+
+
+def iter_array(file, chunk_size=CHUNK_SIZE):
+    """Элементы JSON-массива по одному: в памяти текущий блок файла,
+    а не весь массив"""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    expected = '['
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        value = end = None
+        if position < len(buffer):
+            char = buffer[position]
+            if char == ']' and expected in ('first', ','):
+                return
+            if expected in ('[', ','):
+                if char != expected:
+                    raise CommandError(
+                        f'Invalid JSON array: expected {expected!r} '
+                        f'at {char!r}')
+                position += 1
+                expected = 'first' if expected == '[' else 'value'
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if eof:
+                    raise CommandError(f'Invalid JSON array: {error}')
+        elif eof:
+            raise CommandError('Invalid JSON array: unexpected end of file')
+        # значение у конца блока может продолжаться в следующем блоке
+        if end is None or end == len(buffer) and not eof:
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield value
+        position, expected = end, ','
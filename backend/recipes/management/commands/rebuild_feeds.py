@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from recipes import feed
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild subscription feeds, e.g. after subscriptions or recipes '
+        'were inserted in bulk without signals or FEED_FANOUT_LIMIT changed'
+    )
+
+    def handle(self, *args, **kwargs):
+        entries = feed.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Built {entries} feed entries'))
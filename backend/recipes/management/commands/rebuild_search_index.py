@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes import search
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the recipe full-text search index, e.g. after recipes '
+        'were inserted in bulk without signals'
+    )
+
+    def handle(self, *args, **kwargs):
+        indexed = search.rebuild(Recipe.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} recipes'))
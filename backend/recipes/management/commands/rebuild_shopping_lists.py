@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import live_totals
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized shopping lists and verify them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only compare the table with the live aggregate',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int, default=1000, help='Rows per INSERT'
+        )
+
+    def handle(self, *args, **kwargs):
+        if not kwargs['check']:
+            self.rebuild(kwargs['batch_size'])
+        mismatches = self.verify()
+        if mismatches:
+            raise CommandError(
+                f'{mismatches} shopping list rows differ from the carts')
+        self.stdout.write(
+            self.style.SUCCESS('Shopping lists match the carts'))
+
+    @transaction.atomic
+    def rebuild(self, batch_size):
+        ShoppingListItem.objects.all().delete()
+        ShoppingListItem.objects.bulk_create(
+            (
+                ShoppingListItem(
+                    user_id=row['user_id'],
+                    ingredient_id=row['ingredient_id'],
+                    amount=row['total'],
+                )
+                for row in live_totals().iterator()
+            ),
+            batch_size=batch_size,
+        )
+        self.stdout.write(
+            f'Rebuilt {ShoppingListItem.objects.count()} rows')
+
+    def verify(self):
+        expected = {
+            (row['user_id'], row['ingredient_id']): row['total']
+            for row in live_totals().iterator()
+        }
+        mismatches = 0
+        for user_id, ingredient_id, amount in (
+            ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        ):
+            if expected.pop((user_id, ingredient_id), 0) != amount:
+                mismatches += 1
+                self.stderr.write(
+                    f'user={user_id} ingredient={ingredient_id}: '
+                    f'{amount} in table')
+        for user_id, ingredient_id in expected:
+            mismatches += 1
+            self.stderr.write(
+                f'user={user_id} ingredient={ingredient_id}: missing')
+        return mismatches
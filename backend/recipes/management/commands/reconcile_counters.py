@@ -0,0 +1,72 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe
+from users.models import Subscription
+
+User = get_user_model()
+
+# (модель, поле счётчика, связанная модель, её внешний ключ)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+
+
+def actual_count(related, field):
+    return Coalesce(
+        Subquery(
+            related.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        Value(0),
+    )
+
+
+class Command(BaseCommand):
+    help = 'Recount the denormalized counters and fix the ones that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report the drifted counters (listed with -v 2)',
+        )
+
+    def handle(self, *args, **kwargs):
+        self.verbosity = kwargs['verbosity']
+        drifted = 0
+        for model, field, related, related_field in COUNTERS:
+            drifted += self.reconcile(
+                model, field, related, related_field, kwargs['check'])
+        if drifted and kwargs['check']:
+            raise CommandError(f'{drifted} counters differ from the data')
+        self.stdout.write(self.style.SUCCESS(
+            f'Counters match the data ({drifted} fixed)'
+            if drifted else 'Counters match the data'))
+
+    @transaction.atomic
+    def reconcile(self, model, field, related, related_field, check):
+        drifted = list(
+            model.objects.annotate(actual=actual_count(related, related_field))
+            .exclude(**{field: F('actual')})
+            .values_list('pk', field, 'actual')
+        )
+        for pk, stored, actual in drifted if self.verbosity > 1 else ():
+            self.stderr.write(
+                f'{model._meta.model_name}={pk} {field}: '
+                f'{stored} stored, {actual} actual')
+        if not check:
+            model.objects.bulk_update(
+                (model(pk=pk, **{field: actual}) for pk, _, actual in drifted),
+                (field,),
+                batch_size=500,
+            )
+        return len(drifted)
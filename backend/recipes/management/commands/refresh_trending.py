@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes import trending
+
+
+class Command(BaseCommand):
+    help = (
+        'Drop activity older than the trending window and recompute '
+        'the trending scores. Run periodically, e.g. hourly from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int, default=settings.TRENDING_DAYS,
+            help='Window length in days',
+        )
+
+    def handle(self, *args, **kwargs):
+        scored = trending.refresh(kwargs['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Trending scores refreshed for {scored} recipes'))
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+from recipes import search
+
+
+def create_search_index(apps, schema_editor):
+    # таблица поиска вне ORM, её вид зависит от базы (recipes.search)
+    backend = search.get_backend(schema_editor.connection)
+    for sql in backend.create_sql:
+        schema_editor.execute(sql)
+    Recipe = apps.get_model('recipes', 'Recipe')
+    search.rebuild(Recipe.objects.all(), schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    backend = search.get_backend(schema_editor.connection)
+    schema_editor.execute(backend.drop_sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0022_recipe_scores'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0024_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(choices=[('ready', 'Готово'), ('pending', 'Обрабатывается'), ('failed', 'Ошибка обработки')], default='ready', editable=False, max_length=7, verbose_name='Состояние фото'),
+        ),
+    ]
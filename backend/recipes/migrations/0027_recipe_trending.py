@@ -0,0 +1,37 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:14
+
+from django.db import migrations, models
+
+
+def copy_scores(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    Recipe.objects.filter(score__isnull=False).update(
+        trending=models.Subquery(
+            RecipeScore.objects.filter(recipe=models.OuterRef('pk'))
+            .values('trending')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0026_feed_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='trending',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Популярность за окно'),
+        ),
+        migrations.RunPython(copy_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending', '-pub_date', '-id'], name='recipe_trending_idx'),
+        ),
+        migrations.DeleteModel(
+            name='RecipeScore',
+        ),
+    ]
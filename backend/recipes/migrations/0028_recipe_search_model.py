@@ -0,0 +1,42 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from recipes import search
+
+
+def add_recipe_id(apps, schema_editor):
+    # у таблицы FTS5 был только rowid, RecipeSearch соединяется
+    # по recipe_id; виртуальную таблицу нельзя изменить, создаём заново
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    backend = search.get_backend(schema_editor.connection)
+    schema_editor.execute(backend.drop_sql)
+    for sql in backend.create_sql:
+        schema_editor.execute(sql)
+    Recipe = apps.get_model('recipes', 'Recipe')
+    search.rebuild(Recipe.objects.all(), schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0027_recipe_trending'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_recipe_id, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='RecipeSearch',
+            fields=[
+                ('recipe', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Строка поискового индекса',
+                'verbose_name_plural': 'Поисковый индекс',
+                'db_table': 'recipes_recipe_search',
+                'managed': False,
+            },
+        ),
+    ]
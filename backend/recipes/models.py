@@ -3,19 +3,39 @@ from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db.models import (
     CASCADE,
+    DO_NOTHING,
+    BooleanField,
     CharField,
+    Count,
+    DateField,
     DateTimeField,
+    Exists,
+    F,
     ForeignKey,
     ImageField,
+    Index,
+    IntegerField,
+    JSONField,
     ManyToManyField,
     Model,
+    OneToOneField,
+    OuterRef,
+    PositiveIntegerField,
     PositiveSmallIntegerField,
+    Prefetch,
+    Q,
+    QuerySet,
     SlugField,
     TextField,
     UniqueConstraint,
+    Value,
+    Window,
 )
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
 from core import constants
+from core.counters import CounterFieldsMixin
 
 User = get_user_model()
 
@@ -74,9 +94,94 @@ class Tag(Model):
         return self.name
 
 
-class Recipe(Model):
+class RecipeQuerySet(QuerySet):
+    """Запросы рецептов для выдачи списком без N+1"""
+
+    def with_related(self):
+        """Теги, ингредиенты и автор одним набором запросов"""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_recipe',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient'
+                ).order_by('ingredient__name'),
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """Флаги «в избранном» и «в списке покупок» для пользователя"""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+    def popular(self):
+        """Сначала рецепты, чаще добавленные в избранное"""
+        return self.order_by('-favorites_count', '-pub_date', '-id')
+
+    def trending(self):
+        """Сначала рецепты, чаще добавляемые в избранное и корзину
+        за последние дни (см. recipes.trending)"""
+        return self.order_by('-trending', '-pub_date', '-id')
+
+    def latest_per_author(self, author_ids, limit=None):
+        """Не больше limit последних рецептов каждого автора одним
+        запросом: номер в ленте автора считает ROW_NUMBER() OVER
+        (PARTITION BY author), отбор по нему — во внешнем запросе"""
+        recipes = self.filter(author_id__in=author_ids)
+        if limit is None:
+            return recipes
+        ranked = recipes.annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        ).order_by().values('id', 'position')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(id__in=RawSQL(
+            f'SELECT id FROM ({sql}) ranked WHERE position <= %s',
+            (*params, limit),
+        ))
+
+    def matching(self, ingredient_ids, max_missing=None):
+        """Рецепты хотя бы с одним из ингредиентов, по числу недостающих
+        (missing); быстрый вариант — api.match_index"""
+        queryset = self.annotate(
+            matched=Count(
+                'ingredient_recipe__ingredient',
+                filter=Q(ingredient_recipe__ingredient__in=ingredient_ids),
+                distinct=True,
+            ),
+            size=Count('ingredient_recipe__ingredient', distinct=True),
+        ).filter(matched__gt=0).annotate(missing=F('size') - F('matched'))
+        if max_missing is not None:
+            queryset = queryset.filter(missing__lte=max_missing)
+        return queryset.order_by('missing', '-pub_date', '-id')
+
+
+class Recipe(CounterFieldsMixin, Model):
     """Рецепт"""
 
+    IMAGE_READY = 'ready'
+    IMAGE_PENDING = 'pending'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_READY, 'Готово'),
+        (IMAGE_PENDING, 'Обрабатывается'),
+        (IMAGE_FAILED, 'Ошибка обработки'),
+    )
+
     author = ForeignKey(
         User,
         on_delete=CASCADE,
@@ -93,6 +198,21 @@ class Recipe(Model):
         'Фото',
         upload_to='recipes/images/'
     )
+    # уменьшенные копии фото, см. recipes.images
+    image_variants = JSONField(
+        'Варианты фото',
+        default=dict,
+        blank=True,
+        editable=False
+    )
+    # фото обрабатывается в фоне, см. api.uploads
+    image_status = CharField(
+        'Состояние фото',
+        max_length=7,
+        choices=IMAGE_STATUSES,
+        default=IMAGE_READY,
+        editable=False
+    )
     cooking_time = PositiveSmallIntegerField(
         validators=[
             MinValueValidator(
@@ -119,11 +239,43 @@ class Recipe(Model):
         related_name='recipes',
         verbose_name='Теги'
     )
+    # поддерживается сигналами, см. core.counters
+    favorites_count = PositiveIntegerField(
+        'Добавили в избранное',
+        default=0,
+        editable=False
+    )
+    # сумма RecipeActivity за окно TRENDING_DAYS, см. recipes.trending
+    trending = PositiveIntegerField(
+        'Популярность за окно',
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ('favorites_count', 'trending')
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date', )
+        indexes = [
+            # лента и курсорная пагинация
+            Index(fields=['-pub_date', '-id'], name='recipe_feed_idx'),
+            # фильтр ?author= в порядке ленты
+            Index(fields=['author', '-pub_date'], name='recipe_author_idx'),
+            # ?ordering=popular
+            Index(
+                fields=['-favorites_count', '-pub_date', '-id'],
+                name='recipe_popular_idx',
+            ),
+            # ?ordering=trending
+            Index(
+                fields=['-trending', '-pub_date', '-id'],
+                name='recipe_trending_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -162,6 +314,13 @@ class IngredientRecipe(Model):
     class Meta:
         verbose_name = 'Ингредиенты в рецепте'
         verbose_name_plural = 'Ингредиенты в рецепте'
+        indexes = [
+            # покрывающий индекс для сумм по корзине и состава рецепта
+            Index(
+                fields=['recipe', 'ingredient', 'amount'],
+                name='ingredient_recipe_amount_idx',
+            ),
+        ]
 
     def __str__(self):
         return (f'{self.ingredient.name} '
@@ -221,3 +380,139 @@ class ShoppingCart(Model):
 
     def __str__(self):
         return f'{self.user} {self.recipe}'
+
+
+class ShoppingListItem(Model):
+    """Сумма ингредиента в списке покупок пользователя.
+
+    Денормализованный итог по ShoppingCart: поддерживается
+    recipes.shopping_list при изменении корзины и ингредиентов рецепта.
+    Единица измерения однозначно задаётся ингредиентом.
+    """
+
+    user = ForeignKey(
+        User,
+        on_delete=CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = ForeignKey(
+        Ingredient,
+        on_delete=CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингредиент'
+    )
+    amount = IntegerField('Количество', default=0)
+    updated = DateTimeField('Дата изменения', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'ingredient'], name='shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} - {self.amount}'
+
+
+class RecipeActivity(Model):
+    """Добавления рецепта в избранное и корзину за день"""
+
+    recipe = ForeignKey(
+        Recipe,
+        on_delete=CASCADE,
+        related_name='activity',
+        verbose_name='Рецепт'
+    )
+    day = DateField('День')
+    events = PositiveIntegerField('Добавлений', default=0)
+
+    class Meta:
+        verbose_name = 'Активность по рецепту'
+        verbose_name_plural = 'Активность по рецептам'
+        constraints = [
+            UniqueConstraint(fields=['recipe', 'day'], name='recipe_activity')
+        ]
+        indexes = [
+            # удаление дней, вышедших из окна
+            Index(fields=['day'], name='recipe_activity_day_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} {self.day} - {self.events}'
+
+
+class FeedEntry(Model):
+    """Рецепт в ленте подписчика его автора (см. recipes.feed).
+
+    pub_date и author повторяют поля рецепта: страница ленты читается
+    по индексу без соединения с рецептами, отписка удаляет записи
+    автора без подзапроса.
+    """
+
+    user = ForeignKey(
+        User,
+        on_delete=CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик',
+        # покрыт индексами ниже
+        db_index=False
+    )
+    recipe = ForeignKey(
+        Recipe,
+        on_delete=CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = ForeignKey(
+        User,
+        on_delete=CASCADE,
+        related_name='+',
+        verbose_name='Автор рецепта'
+    )
+    pub_date = DateTimeField('Дата и время публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            UniqueConstraint(fields=['user', 'recipe'], name='feed_entry')
+        ]
+        indexes = [
+            # страница ленты по курсору
+            Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_timeline_idx',
+            ),
+            # отписка от автора
+            Index(fields=['user', 'author'], name='feed_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
+
+
+class RecipeSearch(Model):
+    """Строка индекса полнотекстового поиска (см. recipes.search).
+
+    Таблицу создаёт и заполняет recipes.search, модель нужна только для
+    соединения с рецептами в запросе.
+    """
+
+    recipe = OneToOneField(
+        Recipe,
+        on_delete=DO_NOTHING,
+        primary_key=True,
+        related_name='search_document',
+        db_constraint=False,
+        verbose_name='Рецепт'
+    )
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_search'
+        verbose_name = 'Строка поискового индекса'
+        verbose_name_plural = 'Поисковый индекс'
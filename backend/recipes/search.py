@@ -0,0 +1,154 @@
+"""Полнотекстовый поиск рецептов по названию и описанию.
+
+Индекс — отдельная таблица recipes_recipe_search, её создаёт и
+заполняет этот модуль, а модель RecipeSearch нужна только для
+соединения с рецептами. Вид таблицы зависит от базы:
+
+- SQLite: виртуальная таблица FTS5, rowid и столбец recipe_id —
+  id рецепта. Слова приводятся к основе snowball-стеммером для
+  русского языка при записи и в запросе, релевантность — bm25;
+- PostgreSQL: tsvector со словарём russian и GIN-индексом,
+  релевантность — ts_rank.
+
+Совпадение в названии весит больше, чем в описании. Индекс
+обновляется сигналами на сохранение и удаление Recipe, полностью
+пересобирается командой rebuild_search_index.
+"""
+import re
+
+import snowballstemmer
+from django.db import connection, transaction
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+TABLE = 'recipes_recipe_search'
+WORD = re.compile(r'\w+')
+
+stemmer = snowballstemmer.stemmer('russian')
+
+
+def stem(text):
+    return ' '.join(stemmer.stemWords(WORD.findall(text.lower())))
+
+
+class SqliteBackend:
+    create_sql = (
+        f'CREATE VIRTUAL TABLE {TABLE} USING fts5('
+        'name, text, recipe_id UNINDEXED, '
+        "tokenize='unicode61 remove_diacritics 2')",
+    )
+    drop_sql = f'DROP TABLE {TABLE}'
+    match_sql = f'{TABLE} MATCH %s'
+    # bm25 меньше у более релевантных, веса столбцов: name, text;
+    # считается по строке индекса, уже найденной MATCH в соединении
+    rank_sql = f'-bm25({TABLE}, 10.0, 1.0)'
+    rank_uses_term = False
+
+    @staticmethod
+    def index(cursor, recipe_id, name, text):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [recipe_id])
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, name, text, recipe_id) '
+            'VALUES (%s, %s, %s, %s)',
+            [recipe_id, stem(name), stem(text), recipe_id],
+        )
+
+    @staticmethod
+    def remove(cursor, recipe_id):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [recipe_id])
+
+    @staticmethod
+    def prepare(query):
+        # каждая основа в кавычках: спецсимволы FTS5 не попадут в запрос
+        return ' '.join(f'"{word}"' for word in stem(query).split())
+
+
+class PostgresBackend:
+    create_sql = (
+        f'CREATE TABLE {TABLE} ('
+        'recipe_id bigint PRIMARY KEY '
+        'REFERENCES recipes_recipe (id) ON DELETE CASCADE, '
+        'document tsvector NOT NULL)',
+        f'CREATE INDEX {TABLE}_document_idx ON {TABLE} USING gin (document)',
+    )
+    drop_sql = f'DROP TABLE {TABLE}'
+    match_sql = f"{TABLE}.document @@ plainto_tsquery('russian', %s)"
+    rank_sql = f"ts_rank({TABLE}.document, plainto_tsquery('russian', %s))"
+    rank_uses_term = True
+
+    @staticmethod
+    def index(cursor, recipe_id, name, text):
+        cursor.execute(
+            f'INSERT INTO {TABLE} (recipe_id, document) VALUES (%s, '
+            "setweight(to_tsvector('russian', %s), 'A') || "
+            "setweight(to_tsvector('russian', %s), 'B')) "
+            'ON CONFLICT (recipe_id) DO UPDATE '
+            'SET document = EXCLUDED.document',
+            [recipe_id, name, text],
+        )
+
+    @staticmethod
+    def remove(cursor, recipe_id):
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE recipe_id = %s', [recipe_id])
+
+    @staticmethod
+    def prepare(query):
+        return query.strip()
+
+
+BACKENDS = {
+    'sqlite': SqliteBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+def get_backend(db_connection=connection):
+    return BACKENDS[db_connection.vendor]
+
+
+def index_recipe(recipe):
+    with connection.cursor() as cursor:
+        get_backend().index(cursor, recipe.id, recipe.name, recipe.text)
+
+
+def remove_recipe(recipe_id):
+    with connection.cursor() as cursor:
+        get_backend().remove(cursor, recipe_id)
+
+
+@transaction.atomic
+def rebuild(recipes, db_connection=connection):
+    """Заново индексирует recipes, вернёт их число"""
+    backend = get_backend(db_connection)
+    indexed = 0
+    with db_connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        for recipe_id, name, text in recipes.values_list(
+            'id', 'name', 'text'
+        ).iterator():
+            backend.index(cursor, recipe_id, name, text)
+            indexed += 1
+    return indexed
+
+
+def search(queryset, query):
+    """Рецепты, подходящие под запрос, с релевантностью search_rank.
+
+    Таблица индекса присоединяется к запросу один раз (RecipeSearch):
+    по ней же отбираются совпадения и считается релевантность.
+    """
+    backend = get_backend()
+    term = backend.prepare(query)
+    if not term:
+        return queryset.none()
+    return queryset.filter(
+        RawSQL(backend.match_sql, [term], output_field=BooleanField()),
+        search_document__isnull=False,
+    ).annotate(
+        search_rank=RawSQL(
+            backend.rank_sql,
+            [term] if backend.rank_uses_term else [],
+            output_field=FloatField(),
+        )
+    )
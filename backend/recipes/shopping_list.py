@@ -0,0 +1,108 @@
+"""Инкрементальное обновление списка покупок (ShoppingListItem).
+
+Изменения корзины и ингредиентов рецепта переводятся в приращения
+количества по ингредиентам и применяются одним UPDATE. Строки с нулевым
+количеством не удаляются: по их дате изменения строится Last-Modified
+выгрузки, а rebuild_shopping_lists их вычищает.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Now
+
+from .models import IngredientRecipe, ShoppingCart, ShoppingListItem
+
+
+def recipe_amounts(recipe_id):
+    """Количество каждого ингредиента в рецепте"""
+    return recipes_amounts([recipe_id])
+
+
+def recipes_amounts(recipe_ids):
+    """Количество каждого ингредиента в рецептах, вместе"""
+    amounts = Counter()
+    for ingredient_id, amount in IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('ingredient_id', 'amount'):
+        amounts[ingredient_id] += amount
+    return amounts
+
+
+@transaction.atomic
+def change_amounts(user_ids, deltas):
+    """Прибавляет deltas {ingredient_id: приращение} каждому из user_ids"""
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if not user_ids or not deltas:
+        return
+    ShoppingListItem.objects.bulk_create(
+        (
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items() if delta > 0
+        ),
+        ignore_conflicts=True,
+    )
+    ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas
+    ).update(
+        amount=F('amount') + Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(delta))
+                for ingredient_id, delta in deltas.items()
+            ),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        updated=Now(),
+    )
+
+
+def add_recipe(user_id, recipe_id):
+    change_amounts([user_id], recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_id, recipe_id):
+    amounts = recipe_amounts(recipe_id)
+    change_amounts(
+        [user_id],
+        {ingredient_id: -amount for ingredient_id, amount in amounts.items()}
+    )
+
+
+def add_recipes(user_id, recipe_ids):
+    change_amounts([user_id], recipes_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    amounts = recipes_amounts(recipe_ids)
+    change_amounts(
+        [user_id],
+        {ingredient_id: -amount for ingredient_id, amount in amounts.items()}
+    )
+
+
+def update_recipe(recipe_id, old_amounts):
+    """Переносит изменение состава рецепта в списки покупок"""
+    user_ids = list(
+        ShoppingCart.objects.filter(recipe_id=recipe_id)
+        .values_list('user_id', flat=True)
+    )
+    if not user_ids:
+        return
+    deltas = recipe_amounts(recipe_id)
+    deltas.subtract(old_amounts)
+    change_amounts(user_ids, deltas)
+
+
+def live_totals():
+    """Эталонный итог, посчитанный заново по корзинам"""
+    return (
+        IngredientRecipe.objects.filter(recipe__shopping_cart__isnull=False)
+        .values('ingredient_id', user_id=F('recipe__shopping_cart__user'))
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
@@ -0,0 +1,112 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core import counters
+from core.versions import bump_version
+from users.models import Subscription
+
+from . import feed, search, shopping_list, trending
+from .models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+)
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        shopping_list.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    # pre_delete: при каскадном удалении рецепта его ингредиенты
+    # ещё на месте
+    shopping_list.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    # после коммита: иначе запрос между сменой версии и коммитом
+    # закеширует под новой версией старые строки
+    transaction.on_commit(lambda: bump_version('ingredients'))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('tags'))
+
+
+@receiver(post_save, sender=Favorite)
+def count_favorite(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(Recipe, instance.recipe_id, 'favorites_count')
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def record_activity(sender, instance, created, **kwargs):
+    if created:
+        trending.record(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Favorite)
+def uncount_favorite(sender, instance, **kwargs):
+    counters.decrement(Recipe, instance.recipe_id, 'favorites_count')
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(User, instance.author_id, 'recipes_count')
+
+
+@receiver(post_delete, sender=Recipe)
+def uncount_recipe(sender, instance, **kwargs):
+    counters.decrement(User, instance.author_id, 'recipes_count')
+
+
+@receiver(post_save, sender=Recipe)
+def publish_recipe(sender, instance, created, **kwargs):
+    if created:
+        feed.publish(instance)
+
+
+@receiver(post_save, sender=Subscription)
+def follow_author(sender, instance, created, **kwargs):
+    if created:
+        feed.follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def unfollow_author(sender, instance, **kwargs):
+    feed.unfollow(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, **kwargs):
+    search.index_recipe(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, **kwargs):
+    search.remove_recipe(instance.id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def bump_recipe_ingredients_version(sender, **kwargs):
+    # после коммита: ингредиенты рецепта добавляются уже после его save()
+    transaction.on_commit(lambda: bump_version('recipe-ingredients'))
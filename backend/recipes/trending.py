@@ -0,0 +1,81 @@
+"""Рейтинг «в тренде» по скользящему окну дней.
+
+Каждое добавление в избранное или корзину увеличивает счётчик дня
+(RecipeActivity) и рейтинг рецепта (Recipe.trending). Окно сдвигает
+refresh(): удаляет дни старше TRENDING_DAYS и пересчитывает рейтинги
+из оставшихся. Рейтинг хранится в самом рецепте, как favorites_count,
+поэтому ?ordering=trending читает индекс recipe_trending_idx.
+"""
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Sum, Value, When
+from django.utils import timezone
+
+from .models import Recipe, RecipeActivity
+
+
+def increment(queryset, instance, field):
+    """UPDATE +1, а если строки ещё нет — создать её и повторить"""
+    if queryset.update(**{field: F(field) + 1}):
+        return
+    # ignore_conflicts: строку мог создать параллельный запрос
+    type(instance).objects.bulk_create([instance], ignore_conflicts=True)
+    queryset.update(**{field: F(field) + 1})
+
+
+@transaction.atomic
+def record(recipe_id):
+    today = timezone.localdate()
+    increment(
+        RecipeActivity.objects.filter(recipe_id=recipe_id, day=today),
+        RecipeActivity(recipe_id=recipe_id, day=today),
+        'events',
+    )
+    Recipe.objects.filter(pk=recipe_id).update(trending=F('trending') + 1)
+
+
+@transaction.atomic
+def record_all(recipe_ids):
+    """record() для нескольких рецептов: три запроса на все"""
+    if not recipe_ids:
+        return
+    today = timezone.localdate()
+    RecipeActivity.objects.bulk_create(
+        [RecipeActivity(recipe_id=pk, day=today) for pk in recipe_ids],
+        ignore_conflicts=True,
+    )
+    RecipeActivity.objects.filter(
+        recipe_id__in=recipe_ids, day=today
+    ).update(events=F('events') + 1)
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        trending=F('trending') + 1)
+
+
+@transaction.atomic
+def refresh(days=None, batch_size=1000):
+    """Сдвигает окно и пересчитывает рейтинги, вернёт число рецептов
+    с рейтингом"""
+    days = days or settings.TRENDING_DAYS
+    start = timezone.localdate() - timedelta(days=days - 1)
+    RecipeActivity.objects.filter(day__lt=start).delete()
+    # обнуляются только рецепты с рейтингом, по индексу
+    Recipe.objects.filter(trending__gt=0).update(trending=0)
+    totals = (
+        RecipeActivity.objects.values_list('recipe_id')
+        .annotate(total=Sum('events'))
+        .order_by()
+        .iterator()
+    )
+    scored = 0
+    while batch := list(islice(totals, batch_size)):
+        Recipe.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+            trending=Case(
+                *(When(pk=pk, then=Value(total)) for pk, total in batch),
+                output_field=PositiveIntegerField(),
+            )
+        )
+        scored += len(batch)
+    return scored
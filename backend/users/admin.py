@@ -6,5 +6,12 @@ from .models import User
 
 @admin.register(User)
 class UserInAdmin(UserAdmin):
-    list_display = ('username', 'email', 'first_name', 'last_name')
+    list_display = (
+        'username',
+        'email',
+        'first_name',
+        'last_name',
+        'recipes_count',
+        'subscribers_count',
+    )
     search_fields = ('email', 'username')
@@ -0,0 +1,62 @@
+"""Аутентификация по токену с кешем.
+
+TokenAuthentication DRF на каждый запрос выполняет запрос Token JOIN
+User. Здесь токен и пользователь берутся из кеша Django на
+AUTH_TOKEN_CACHE_TIMEOUT секунд: локальный кеш процесса — LRU с
+ограничением размера и TTL, при CACHE_DIR кеш общий для процессов.
+Запись удаляют сигналы (users.signals) после коммита: удаление
+токена (выход, удаление пользователя) и сохранение пользователя
+(смена пароля, деактивация, правка профиля). Кеш чистится только в
+своём процессе, поэтому несколько воркеров gunicorn без CACHE_DIR не
+запускаются (gunicorn.conf.py). Изменения в обход сигналов, например
+QuerySet.update(is_active=False), применятся по истечении TTL.
+
+Пароль и счётчики (editable=False) в кеш не попадают и загружаются
+отложенно, поэтому save() такого пользователя не перезаписывает
+счётчики, которые меняются через F() в обход модели.
+"""
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import User
+
+USER_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.primary_key or field.editable and field.name != 'password'
+)
+TOKEN_FIELDS = ('key', 'user_id', 'created')
+
+
+def cache_key(token_key):
+    return f'auth-token:{sha256(token_key.encode()).hexdigest()}'
+
+
+def forget_token(token_key):
+    cache.delete(cache_key(token_key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = cache.get(cache_key(key))
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(
+                cache_key(key),
+                (
+                    token.created,
+                    tuple(getattr(user, name) for name in USER_FIELDS),
+                ),
+                settings.AUTH_TOKEN_CACHE_TIMEOUT,
+            )
+            return user, token
+        created, values = cached
+        user = User.from_db(DEFAULT_DB_ALIAS, USER_FIELDS, values)
+        token = Token.from_db(
+            DEFAULT_DB_ALIAS, TOKEN_FIELDS, (key, user.pk, created))
+        token.user = user
+        return user, token
@@ -2,9 +2,10 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 from core import constants
+from core.counters import CounterFieldsMixin
 
 
-class User(AbstractUser):
+class User(CounterFieldsMixin, AbstractUser):
     """Переопределяем модель User."""
 
     USERNAME_FIELD = 'email'
@@ -20,6 +21,19 @@ class User(AbstractUser):
     last_name = models.CharField(
         max_length=constants.NAME_MAX_LENGHT
     )
+    # поддерживаются сигналами, см. core.counters
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов',
+        default=0,
+        editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Число подписчиков',
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ('recipes_count', 'subscribers_count')
 
     class Meta:
         verbose_name = 'пользователь'
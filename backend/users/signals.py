@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core import counters
+
+from .authentication import forget_token
+from .models import Subscription, User
+
+
+@receiver(post_save, sender=Subscription)
+def count_subscriber(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(User, instance.author_id, 'subscribers_count')
+
+
+@receiver(post_delete, sender=Subscription)
+def uncount_subscriber(sender, instance, **kwargs):
+    counters.decrement(User, instance.author_id, 'subscribers_count')
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: forget_token(key))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, **kwargs):
+    """Смена пароля, деактивация и правка профиля сбрасывают кеш
+    аутентификации (users.authentication).
+
+    После коммита: запрос, пришедший до него, прочитал бы прежнего
+    пользователя и снова положил его в кеш.
+    """
+    if created:
+        return
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list(
+        'key', flat=True))
+
+    def forget():
+        for key in keys:
+            forget_token(key)
+
+    transaction.on_commit(forget)